@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import mmap
+import time
+import socket
+import struct
+import threading
+
+
+MAGIC = b'blueshift-curse capture 2\n'
+'''
+:bytes  The first bytes of a capture log
+'''
+
+FRAME = struct.Struct('<qBII')
+'''
+:Struct  The header of a frame: monotonic time in nanoseconds,
+         direction, connection ID and the length of the payload
+'''
+
+TO_CLIENT = 0
+'''
+Direction: sent from the server to a client
+'''
+
+TO_SERVER = 1
+'''
+Direction: sent from a client to the server
+'''
+
+
+class Capture:
+    '''
+    Binary log of IPC traffic
+    
+    The log starts with `MAGIC` and is followed by frames,
+    each a `FRAME` header followed by its payload: one or
+    more complete text lines, including their line breaks,
+    except that lines that are read as they arrive, see
+    `DSocket.read_available`, may be split between frames.
+    
+    At the server end, the traffic of all clients is recorded
+    in the same log, each client's frames with its own connection
+    ID, so a broadcast is recorded once per client. At the client
+    end, the connection ID is always 0. Each frame is flushed as it
+    is recorded, so the log is usable even if the process is killed.
+    
+    @variable  server:bool  Whether the log is written at the server end
+    '''
+    
+    def __init__(self, pathname, server):
+        '''
+        Constructor
+        
+        @param  pathname:str  The log file, will be truncated
+        @param  server:bool   Whether the log is written at the server end
+        '''
+        self.server = server
+        self.file = open(pathname, 'wb')
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()
+    
+    
+    def record(self, data, received, connection = 0):
+        '''
+        Append a frame
+        
+        @param  data:bytes      The text lines, including their line breaks
+        @param  received:bool   Whether the data was received, otherwise sent
+        @param  connection:int  The ID of the connection the data was sent over
+        '''
+        direction = TO_CLIENT if received != self.server else TO_SERVER
+        header = FRAME.pack(time.monotonic_ns(), direction, connection, len(data))
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(header + data)
+                self.file.flush()
+    
+    
+    def close(self):
+        '''
+        Close the log
+        '''
+        with self.lock:
+            self.file.close()
+
+
+class Replay:
+    '''
+    Reader of a binary log of IPC traffic, see `Capture`
+    
+    Stale `Trace:` lines are removed from the replayed traffic. Only
+    the traffic of one connection is replayed, by default the first
+    connection in the log, so that messages recorded once per client
+    at the server end are not replayed once per recorded client.
+    
+    @variable  data:mmap  The memory-mapped log
+    '''
+    
+    def __init__(self, pathname):
+        '''
+        Constructor
+        
+        @param  pathname:str  The log file
+        '''
+        with open(pathname, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        if not self.data[:len(MAGIC)] == MAGIC:
+            self.data.close()
+            raise ValueError('%s is not a blueshift-curse capture log' % pathname)
+    
+    
+    def frames(self, direction = None, connection = None):
+        '''
+        Iterate over the frames in the log
+        
+        @param   direction:int?                      Only include frames in this direction,
+                                                     `None` for all frames
+        @param   connection:int?                     Only include frames of this connection,
+                                                     `None` for all connections
+        @return  :itr<(int, int, int, memoryview)>  The time, direction, connection ID and
+                                                     payload of each frame
+        '''
+        data, offset = memoryview(self.data), len(MAGIC)
+        end = len(data) - FRAME.size
+        while offset <= end:
+            (ns, direction_, connection_, length) = FRAME.unpack_from(data, offset)
+            offset += FRAME.size
+            if direction is None or direction == direction_:
+                if connection is None or connection == connection_:
+                    yield (ns, direction_, connection_, data[offset : offset + length])
+            offset += length
+    
+    
+    def first_connection(self, direction = TO_CLIENT):
+        '''
+        Get the ID of the first connection with traffic in a direction
+        
+        @param   direction:int  The direction
+        @return  :int?          The connection ID, `None` if there is no such traffic
+        '''
+        for (_ns, _direction, connection, _payload) in self.frames(direction):
+            return connection
+        return None
+    
+    
+    def play(self, target, direction = TO_CLIENT, paced = True, connection = None):
+        '''
+        Pass the frames of one connection in one direction to a function
+        
+        @param  target:(bytes)→void  The function to invoke with the payload of each frame
+        @param  direction:int        The direction of the frames to replay
+        @param  paced:bool           Whether to keep the original time between frames,
+                                     otherwise, replay as fast as possible
+        @param  connection:int?      The connection to replay, `None` for the first
+        '''
+        if connection is None:
+            connection = self.first_connection(direction)
+            if connection is None:
+                return
+        start = first = None
+        for (ns, _direction, _connection, payload) in self.frames(direction, connection):
+            if paced:
+                if first is None:
+                    (start, first) = (time.monotonic_ns(), ns)
+                delay = (ns - first) - (time.monotonic_ns() - start)
+                if delay > 0:
+                    time.sleep(delay / 1e9)
+            payload = bytes(payload)
+            if b'Trace: ' in payload:
+                lines = payload.split(b'\n')
+                payload = b'\n'.join(line for line in lines if not line.startswith(b'Trace: '))
+            if len(payload) > 0:
+                target(payload)
+    
+    
+    def serve(self, server, paced = True, connection = None):
+        '''
+        Broadcast the messages sent to a client from a server
+        
+        @param  server:Server    The server
+        @param  paced:bool       Whether to keep the original time between messages
+        @param  connection:int?  The connection to replay, `None` for the first
+        '''
+        def broadcast(payload):
+            for line in payload.decode('utf-8', 'replace').split('\n')[:-1]:
+                server.broadcast(line)
+        self.play(broadcast, TO_CLIENT, paced, connection)
+    
+    
+    def connect(self, paced = True, connection = None):
+        '''
+        Create a socket from which the messages sent to a client can be
+        read, they are written to it asynchronously, and the socket is
+        shut down for writing once all messages have been written
+        
+        @param   paced:bool       Whether to keep the original time between messages
+        @param   connection:int?  The connection to replay, `None` for the first
+        @return  :socket          The socket, messages written to it are discarded
+        '''
+        (ours, theirs) = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        def play_():
+            try:
+                self.play(ours.sendall, TO_CLIENT, paced, connection)
+                ours.shutdown(socket.SHUT_WR)
+                while len(ours.recv(4096)) > 0:
+                    pass
+            except OSError:
+                pass
+            finally:
+                ours.close()
+        thread = threading.Thread(target = play_)
+        thread.setDaemon(True)
+        thread.start()
+        return theirs
+    
+    
+    def close(self):
+        '''
+        Unmap the log
+        '''
+        self.data.close()
@@ -17,6 +17,8 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import socket
+import threading
 
 from dsocket import DSocket
 
@@ -24,13 +26,97 @@ from dsocket import DSocket
 class Client(DSocket):
     '''
     Blueshift-curse client
+    
+    @variable  pending:dict<str, (bool, str)?→void>  Callbacks for unanswered requests, by ID
     '''
     
-    def __init__(self):
+    def __init__(self, sockfile = None):
         '''
         Constructor
+        
+        @param  sockfile:str?|socket  The pathname of the socket, `None` for the one of the
+                                      blueshift instance on the current display, or an
+                                      already connected socket
         '''
-        sockfile = '/dev/shm/.blueshift-curse-%s~%s'
-        sockfile %= (os.environ['DISPLAY'], os.environ['USER'])
-        DSocket.__init__(self, sockfile, False)
-
+        if isinstance(sockfile, socket.socket):
+            DSocket.__init__(self, sockfile)
+        else:
+            if sockfile is None:
+                sockfile = Client.pathname()
+            DSocket.__init__(self, sockfile, False)
+        self.pending = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+    
+    
+    @staticmethod
+    def pathname(display = None):
+        '''
+        Get the pathname of the socket of a blueshift instance
+        
+        @param   display:str?  The display the instance is running on, `None` for the current display
+        @return  :str          The pathname of the socket
+        '''
+        if display is None:
+            display = os.environ['DISPLAY']
+        return '/dev/shm/.blueshift-curse-%s~%s' % (display, os.environ['USER'])
+    
+    
+    def subscribe(self, *patterns):
+        '''
+        Select which settings the server should send
+        
+        @param  patterns:*str  Setting names or glob patterns, none for all settings
+        '''
+        self.write('Subscribe: ' + ' '.join(patterns))
+    
+    
+    def request(self, command, argument = None, callback = None):
+        '''
+        Send a request without waiting for the response
+        
+        Any number of requests can be sent before the responses
+        arrive, and the server may respond in any order.
+        
+        @param   command:str                 The command
+        @param   argument:str?               The argument of the command
+        @param   callback:(bool, str)?→void  Function to invoke with whether the request was
+                                             successful and the result or error description,
+                                             when the response has been read by `response`
+        @return  :str                        The ID of the request
+        '''
+        with self.lock:
+            id = str(self.next_id)
+            self.next_id += 1
+            self.pending[id] = callback
+        line = 'Request: %s %s' % (id, command)
+        if argument is not None:
+            line += ' ' + argument
+        self.write(line)
+        return id
+    
+    
+    def response(self, payload):
+        '''
+        Act upon a response from the server
+        
+        @param  payload:str  The payload part of the `Response:` message
+        '''
+        (id, status, payload) = (payload.split(' ', 2) + ['', ''])[:3]
+        with self.lock:
+            callback = self.pending.pop(id, None)
+        if callback is not None:
+            callback(status == 'ok', payload)
+    
+    
+    def cancel(self, message):
+        '''
+        Fail all unanswered requests, should be called when the connection has closed
+        
+        @param  message:str  The error description to pass to the callbacks
+        '''
+        with self.lock:
+            (pending, self.pending) = (self.pending, {})
+        for callback in pending.values():
+            if callback is not None:
+                callback(False, message)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from array import array
+
+from server import Server
+from client import Client
+
+
+def churn(sockfile, stop, counts, index):
+    '''
+    Connect and disconnect repeatedly
+    
+    @param  sockfile:str  The pathname of the socket
+    @param  stop:Event    Set when the benchmark is over
+    @param  counts:array  The number of connections made by each thread
+    @param  index:int     The index of this thread in `counts`
+    '''
+    while not stop.is_set():
+        try:
+            client = Client(sockfile)
+            client.write('Subscribe: synthetic*')
+            client.close()
+            counts[index] += 1
+        except OSError:
+            pass
+
+
+def drain(client):
+    '''
+    Read and discard everything sent to a client until it is closed
+    
+    @param  client:Client  The client
+    '''
+    try:
+        while client.read() is not None:
+            pass
+    except OSError:
+        pass
+
+
+def broadcast(server, stop, durations):
+    '''
+    Broadcast repeatedly, measuring how long each broadcast takes
+    
+    @param  server:Server    The server
+    @param  stop:Event       Set when the benchmark is over
+    @param  durations:array  Array to append the duration, in nanoseconds, of each broadcast to
+    '''
+    while not stop.is_set():
+        start = time.monotonic_ns()
+        server.broadcast('Sequence: 0')
+        durations.append(time.monotonic_ns() - start)
+
+
+def main(args = None):
+    '''
+    Run the contention benchmark
+    
+    Threads connect and disconnect as fast as they can, while other
+    threads broadcast as fast as they can to the clients that happen
+    to be connected. Reports the connection and broadcast rates, and
+    the distribution of the time spent in each broadcast.
+    
+    @param  args:list<str>?  Command line arguments, `None` for `sys.argv[1:]`
+    '''
+    parser = argparse.ArgumentParser(prog = 'contention', description = 'Server locking contention benchmark')
+    parser.add_argument('--churners', type = int, default = 8, help = 'threads connecting and disconnecting')
+    parser.add_argument('--broadcasters', type = int, default = 2, help = 'threads broadcasting')
+    parser.add_argument('--idle', type = int, default = 50, help = 'clients connected, and reading, throughout')
+    parser.add_argument('--duration', type = float, default = 5.0, help = 'seconds to run')
+    args = parser.parse_args(args)
+    
+    sockfile = os.path.join(tempfile.mkdtemp(), 'socket')
+    stop = threading.Event()
+    counts = array('Q', bytes(8 * args.churners))
+    durations = [array('q') for _ in range(args.broadcasters)]
+    
+    with Server(sockfile = sockfile) as server:
+        server.listen(None)
+        server.serve()
+        idle = [Client(sockfile) for _ in range(args.idle)]
+        threads = [threading.Thread(target = drain, args = (client,)) for client in idle]
+        threads += [threading.Thread(target = churn, args = (sockfile, stop, counts, i)) for i in range(args.churners)]
+        threads += [threading.Thread(target = broadcast, args = (server, stop, d)) for d in durations]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads[len(idle):]:
+            thread.join()
+        for client in idle:
+            client.close()
+    os.rmdir(os.path.dirname(sockfile))
+    
+    durations = sorted(duration for d in durations for duration in d)
+    out = 'connects:    %.0f/s\n' % (sum(counts) / args.duration)
+    out += 'broadcasts:  %.0f/s\n' % (len(durations) / args.duration)
+    if len(durations) > 0:
+        quantile = lambda q : durations[min(len(durations) - 1, int(q * len(durations)))] / 1000
+        out += 'broadcast:   median %.1f µs, p99 %.1f µs, max %.1f µs\n' % (
+            quantile(0.5), quantile(0.99), durations[-1] / 1000)
+    sys.stdout.buffer.write(out.encode('utf-8'))
+    sys.stdout.buffer.flush()
+
+
+if __name__ == '__main__':
+    main()
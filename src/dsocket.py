@@ -17,15 +17,44 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import codecs
 import socket
 import threading
 
 
+class Fragment(str):
+    '''
+    Part of a line that is passed on as it arrives, see `DSocket.read_available`
+    
+    @variable  end:bool  Whether this is the last part of the line
+    '''
+    
+    def __new__(cls, text, end):
+        '''
+        Constructor
+        
+        @param  text:str  The part of the line, the first part includes the beginning
+                          of the line, the last part excludes the line break
+        @param  end:bool  Whether this is the last part of the line
+        '''
+        self = str.__new__(cls, text)
+        self.end = end
+        return self
+
+
 class DSocket:
     '''
     Domain socket
     
-    @variable  scoket:socket  The socket
+    @variable  scoket:socket                The socket
+    @variable  capture:Capture?             Log to record all traffic in, `None` if not capturing
+    @variable  connection:int               The ID of the connection in `capture`
+    @variable  max_line:int?                The maximum length of a line, longer lines are discarded,
+                                            `None` for no limit
+    @variable  rejected:int                 The number of lines that have been discarded
+    @variable  stream_prefixes:tuple<str>   The beginnings of lines that `read_available`
+                                            passes on, in fragments, as they arrive, these
+                                            lines are not subject to `max_line`
     '''
     
     def __init__(self, pathname, server = None):
@@ -45,10 +74,19 @@ class DSocket:
             self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
             if server:
                 os.fchmod(self.socket.fileno(), 0o600)
-                self.socket.connect(pathname)
-            else:
                 self.socket.bind(pathname)
+            else:
+                self.socket.connect(pathname)
         self.buffer = ''
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.capture = None
+        self.connection = 0
+        self.max_line = None
+        self.rejected = 0
+        self.stream_prefixes = ()
+        self.streaming = False
+        self.discarding = False
+        self.write_lock = threading.Lock()
     
     
     def write(self, text):
@@ -57,7 +95,20 @@ class DSocket:
         
         @param  text:str  The line
         '''
-        self.socket.send((text + '\n').encode('utf-8'))
+        self.send((text + '\n').encode('utf-8'))
+    
+    
+    def send(self, data):
+        '''
+        Send encoded text lines
+        
+        @param  data:bytes  The lines, UTF-8 encoded, including their line breaks
+        '''
+        with self.write_lock:
+            self.socket.sendall(data)
+            # Record in the order the data was sent
+            if self.capture is not None:
+                self.capture.record(data, False, self.connection)
     
     
     def read(self):
@@ -67,15 +118,75 @@ class DSocket:
         @return  :str?  The next line, `None` if the connection has closed,
                         in which case, close the connection on your end
         '''
-        while True:
-            got = self.socket.recv(1024).decode('utf-8', 'error')
+        while '\n' not in self.buffer:
+            got = self.socket.recv(1024)
             if len(got) == 0:
                 return None
+            # Characters can be split between reads
+            got = self.decoder.decode(got)
             self.buffer += got
-            if '\n' in self.buffer:
-                i = self.buffer.find('\n')
-                rc, self.buffer = self.buffer[:i], self.buffer[i + 1:]
-                return rc
+            if self.max_line is not None and len(self.buffer) > self.max_line:
+                if '\n' not in self.buffer:
+                    # Discard the line without keeping it
+                    self.rejected += 1
+                    while '\n' not in got:
+                        got = self.socket.recv(1024)
+                        if len(got) == 0:
+                            return None
+                        got = self.decoder.decode(got)
+                    self.buffer = got[got.find('\n') + 1:]
+        i = self.buffer.find('\n')
+        rc, self.buffer = self.buffer[:i], self.buffer[i + 1:]
+        if self.capture is not None:
+            self.capture.record((rc + '\n').encode('utf-8'), True, self.connection)
+        return rc
+    
+    
+    def read_available(self):
+        '''
+        Read the lines that have arrived, without waiting for more,
+        should only be called when the socket is known to be readable,
+        for example by a selector, and not mixed with `read`
+        
+        Lines that begin with any of `stream_prefixes` are not
+        buffered until they are complete, but are returned as
+        `Fragment`:s, the last of which has `end` set, so that they
+        can be parsed as they arrive, using little memory however
+        long they are. Lines that are longer than `max_line` are
+        discarded and counted in `rejected`.
+        
+        @return  :list<str>?  The complete lines and fragments received, possibly none,
+                              `None` if the connection has closed, in which case, close
+                              the connection on your end
+        '''
+        got = self.socket.recv(4096)
+        if len(got) == 0:
+            return None
+        # Characters can be split between reads
+        (text, rc) = (self.buffer + self.decoder.decode(got), [])
+        while len(text) > 0:
+            i = text.find('\n')
+            if self.streaming:
+                rc.append(Fragment(text if i < 0 else text[:i], i >= 0))
+                self.streaming = i < 0
+            elif self.discarding:
+                self.discarding = i < 0
+            elif i >= 0:
+                rc.append(text[:i])
+            elif any(text.startswith(prefix) for prefix in self.stream_prefixes):
+                rc.append(Fragment(text, False))
+                self.streaming = True
+            elif self.max_line is not None and len(text) > self.max_line:
+                self.rejected += 1
+                self.discarding = True
+            else:
+                break
+            text = '' if i < 0 else text[i + 1:]
+        self.buffer = text
+        if self.capture is not None and len(rc) > 0:
+            data = ''.join(line + ('\n' if getattr(line, 'end', True) else '') for line in rc)
+            self.capture.record(data.encode('utf-8'), True, self.connection)
+        return rc
     
     
     def listen(self, target):
@@ -89,7 +200,11 @@ class DSocket:
         def listen_():
             self.socket.listen(5)
             while True:
-                (sock, _address) = self.socket.accept()
+                try:
+                    (sock, _address) = self.socket.accept()
+                except OSError:
+                    # The socket has been closed
+                    break
                 sock = DSocket(sock)
                 thread = threading.Thread(target = target, args = (sock,))
                 thread.setDaemon(True)
@@ -102,8 +217,12 @@ class DSocket:
     
     def close(self):
         '''
-        Close the socket
+        Close the socket, threads blocked reading from it are woken
         '''
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         self.socket.close()
     
     
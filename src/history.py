@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+from array import array
+
+
+SPARKS = '▁▂▃▄▅▆▇█'
+'''
+:str  The glyphs of a sparkline, from the lowest to the highest
+'''
+
+
+class History:
+    '''
+    Fixed-capacity value history of numeric settings
+    
+    The histories of all settings are ring buffers stored in one
+    preallocated block, one row per setting, so the memory use only
+    depends on the number of settings, not on the number of updates.
+    The rows of settings that are no longer present are reused, see
+    `retain`, so settings being renamed or replaced do not grow it.
+    
+    @variable  capacity:int         The number of values kept per setting
+    @variable  rows:dict<str, int>  The row of each setting, by name
+    @variable  free:list<int>       Rows that have been released and can be reused
+    @variable  values:array         The values, `capacity` per row
+    @variable  counts:array         The number of values appended to each row
+    '''
+    
+    def __init__(self, capacity = 256, settings = 16):
+        '''
+        Constructor
+        
+        @param  capacity:int  The number of values kept per setting
+        @param  settings:int  The number of settings to preallocate rows for
+        '''
+        self.capacity = capacity
+        self.rows = {}
+        self.free = []
+        self.values = array('d', bytes(8 * capacity * settings))
+        self.counts = array('Q', bytes(8 * settings))
+    
+    
+    def row(self, name):
+        '''
+        Get the row of a setting, allocating it if necessary
+        
+        @param   name:str  The name of the setting
+        @return  :int      The row
+        '''
+        row = self.rows.get(name, None)
+        if row is None and len(self.free) > 0:
+            row = self.free.pop()
+            self.counts[row] = 0
+            self.rows[name] = row
+        elif row is None:
+            row = len(self.rows)
+            if row == len(self.counts):
+                # Double the number of rows, this only happens
+                # when a new setting is seen, never per update
+                self.values.extend(array('d', bytes(8 * self.capacity * row)))
+                self.counts.extend(array('Q', bytes(8 * row)))
+            self.rows[name] = row
+        return row
+    
+    
+    def retain(self, names):
+        '''
+        Release the rows of settings that are no longer present
+        
+        @param  names:container<str>  The names of the present settings
+        '''
+        for name in [name for name in self.rows if name not in names]:
+            self.free.append(self.rows.pop(name))
+    
+    
+    def append(self, name, value):
+        '''
+        Append a value to the history of a setting
+        
+        @param  name:str         The name of the setting
+        @param  value:int|float  The value
+        '''
+        row = self.row(name)
+        count = self.counts[row]
+        self.values[row * self.capacity + count % self.capacity] = value
+        self.counts[row] = count + 1
+    
+    
+    def get(self, name):
+        '''
+        Get the history of a setting
+        
+        @param   name:str  The name of the setting
+        @return  :array    The kept values, oldest first
+        '''
+        row = self.rows.get(name, None)
+        if row is None:
+            return array('d')
+        (start, count) = (row * self.capacity, self.counts[row])
+        if count <= self.capacity:
+            return self.values[start : start + count]
+        head = start + count % self.capacity
+        return self.values[head : start + self.capacity] + self.values[start : head]
+    
+    
+    def sparkline(self, name, width, minimum = None, maximum = None):
+        '''
+        Render the history of a setting as a sparkline
+        
+        If there are more values than columns, the values are divided
+        into one bucket per column, and each column shows the maximum
+        of its bucket, or the minimum if the value has been falling
+        
+        @param   name:str            The name of the setting
+        @param   width:int           The maximum number of columns
+        @param   minimum:int|float?  The value of the lowest glyph, `None` for the lowest value in the history
+        @param   maximum:int|float?  The value of the highest glyph, `None` for the highest value in the history
+        @return  :str                The sparkline
+        '''
+        values = self.get(name)
+        if width <= 0 or len(values) == 0:
+            return ''
+        if len(values) > width:
+            (step, columns) = (len(values) / width, [])
+            for column in range(width):
+                bucket = values[int(column * step) : int((column + 1) * step)]
+                columns.append(min(bucket) if bucket[-1] < bucket[0] else max(bucket))
+            values = columns
+        low = min(values) if minimum is None else minimum
+        high = max(values) if maximum is None else maximum
+        if not high > low:
+            return SPARKS[len(SPARKS) // 2] * len(values)
+        scale = (len(SPARKS) - 1) / (high - low)
+        top = len(SPARKS) - 1
+        return ''.join(SPARKS[min(top, max(0, int((value - low) * scale + 0.5)))] for value in values)
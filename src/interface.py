@@ -18,14 +18,27 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
 import sys
+import ast
+import copy
+import time
 import fcntl
 import struct
+import types
 import signal
+import socket
 import termios
+import selectors
 import threading
 
-from settings import Settings
+from settings import Settings, SettingsDecoder, Setting, Transition
 from client import Client
+from dsocket import Fragment
+from tracing import Tracer
+from capture import Capture, Replay
+from history import History
+from profiling import Profiler
+from validation import Validator
+import widgets
 
 
 
@@ -81,7 +94,7 @@ class Condition(threading.Condition):
         '''
         Constructor
         '''
-        threading.Condition.__init__(*args, **kwargs)
+        threading.Condition.__init__(self, *args, **kwargs)
     
     def __enter__(self):
         '''
@@ -97,14 +110,88 @@ class Condition(threading.Condition):
         self.release()
 
 
-last_loaded_script = None
+class Display:
+    '''
+    A blueshift instance the interface is attached to
+    
+    Each instance is tracked independently, so that
+    one that is slow or has died does not affect the others
+    
+    @variable  name:str                           The display the instance is running on
+    @variable  client:Client?                     The IPC client socket, `None` if it could not connect
+    @variable  connected:bool                     Whether the connection is still open
+    @variable  settings:Settings?                 The latest settings received from the server
+    @variable  transitions:dict<str, Transition>  The ongoing transitions, by setting name
+    @variable  history:History                    The recent values of the numeric settings
+    @variable  pid:int?                           The process ID of the blueshift instance
+    @variable  script:str?                        The last script that has been loaded at the request of the server
+    @variable  trace_sent:int?                    The time the server sent the next message, if traced
+    @variable  trace_offset:int?                  The `tracer` record of the message being processed, if traced
+    @variable  decoder:SettingsDecoder?           Decoder of the settings being received, if any
+    @variable  incoming:Settings?                 The part of the settings being received that has been decoded
+    @variable  validator:Validator                Validator of values of the settings
+    '''
+    
+    def __init__(self, name, client):
+        '''
+        Constructor
+        
+        @param  name:str        The display the instance is running on
+        @param  client:Client?  The IPC client socket, `None` if it could not connect
+        '''
+        self.name = name
+        self.client = client
+        self.connected = client is not None
+        self.settings = None
+        self.transitions = {}
+        self.history = History()
+        self.pid = None
+        self.script = None
+        self.trace_sent = None
+        self.trace_offset = None
+        self.decoder = None
+        self.incoming = None
+        self.validator = Validator()
+    
+    def request(self, command, argument = None, callback = None):
+        '''
+        Send a request to the server without waiting for the response
+        
+        If the request cannot be sent, the connection is shut down, `updates_listen`
+        will notice that and fail all unanswered requests with `close_display`
+        
+        @param   command:str                 The command
+        @param   argument:str?               The argument of the command
+        @param   callback:(bool, str)?→void  Function to invoke with whether the request
+                                             was successful and the result or error description
+        @return  :str?                       The ID of the request, `None` if it was not sent
+        '''
+        if not self.connected:
+            if callback is not None:
+                callback(False, 'not connected')
+            return None
+        try:
+            return self.client.request(command, argument, callback)
+        except OSError:
+            try:
+                self.client.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            if not self.connected:
+                # Closed while sending, `close_display` may
+                # already have failed the other requests
+                self.client.cancel('not connected')
+            return None
+
+
+displays = []
 '''
-:str?  The last script that has been loaded at the request of the server
+:list<Display>  The blueshift instances the interface is attached to
 '''
 
-ipc_client = None
+display_names = []
 '''
-:Client  The IPC client socket
+:list<str>  The displays whose servers to attach to, empty for the current display
 '''
 
 updates_thread = None
@@ -112,14 +199,29 @@ updates_thread = None
 :Thread  Thread running `updates_listen`
 '''
 
-condition = Condition()
+script_thread = None
 '''
-:Condition  Update condition
+:Thread?  Thread running `script_loop`, `None` until a script has been requested
+'''
+
+script_condition = Condition()
+'''
+:Condition  Condition for `pending_script`
+'''
+
+pending_script = None
+'''
+:str?  Script requested by the server that `script_loop` has not started loading
+'''
+
+script_error = None
+'''
+:Exception?  The error raised by the last script requested by the server, if it failed
 '''
 
-blueshift_pid = None
+condition = Condition()
 '''
-:int?  The process ID of the blueshift instance at the server end
+:Condition  Update condition
 '''
 
 height = 25
@@ -142,6 +244,91 @@ redraw = True
 :bool  Whether to redraw everything
 '''
 
+updated = True
+'''
+:bool  Whether there is anything new to paint
+'''
+
+frame_interval = 1 / 30
+'''
+:float  The number of seconds between repaints while any setting is in transition
+'''
+
+render_thread = None
+'''
+:Thread  Thread running `render_loop`
+'''
+
+tracer = None
+'''
+:Tracer?  Update latency tracer, `None` if tracing is disabled
+'''
+
+profiler = None
+'''
+:Profiler?  The profiler, `None` until it is first started
+'''
+
+profiler_lock = threading.Lock()
+'''
+:Lock  Lock for starting and stopping `profiler`
+'''
+
+status = None
+'''
+:str?  Message, such as an error, shown on the bottom row of the screen, `None` if there is none
+'''
+
+connected = True
+'''
+:bool  Whether the connection to any of the servers is still open
+'''
+
+batch_mode = False
+'''
+:bool  Whether to run non-interactively, see `run_batch`
+'''
+
+batch_input_done = False
+'''
+:bool  Whether the end of the standard input has been reached in batch mode
+'''
+
+watching = []
+'''
+:list<str>  Setting names or glob patterns whose changes are reported in batch mode
+'''
+
+output_lock = threading.Lock()
+'''
+:Lock  Lock for writing results in batch mode
+'''
+
+capture_file = None
+'''
+:str?  File to record the IPC traffic in, `None` if not capturing
+'''
+
+replay_file = None
+'''
+:str?  Capture log to replay instead of connecting to the server, `None` to connect
+'''
+
+replay_paced = True
+'''
+:bool  Whether to replay at the original pace, otherwise as fast as possible
+'''
+
+max_message = 1 << 20
+'''
+:int  The maximum length of a message from a server, and of each setting in a `Settings:` message
+'''
+
+send_timeout = 2
+'''
+:float  The number of seconds to wait for a server to accept a request before giving up on it
+'''
+
 
 def print(text = '', end = '\n', flush = None):
     '''
@@ -172,12 +359,35 @@ def printerr(text = '', end = '\n', flush = None):
         sys.stderr.buffer.flush()
 
 
+def report(text):
+    '''
+    Tell the user about something that did not happen in
+    response to a command, such as an error, on the bottom row of
+    the screen, or, in batch mode or without the screen, on the
+    standard error
+    
+    @param  text:str  The message
+    '''
+    global status, updated
+    if batch_mode or saved_stty is None:
+        with output_lock:
+            printerr('%s: %s' % (PROGRAM_NAME, text))
+    else:
+        with condition:
+            status = text
+            updated = True
+            condition.notify()
+
+
 def update_size():
     '''
     Update the bookkeeping on the terminal's dimension
     '''
     global height, width
+    old_width = width
     (height, width) = struct.unpack('hh', fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, '1234'))
+    if not width == old_width:
+        widgets.clear()
 
 
 def winch_trap(sig, frame):
@@ -187,8 +397,10 @@ def winch_trap(sig, frame):
     @param  sig:int     The signal
     @param  frame:None  Will most likely be `None`
     '''
+    global updated
     update_size()
     with condition:
+        updated = True
         condition.notify()
 
 
@@ -199,11 +411,54 @@ def listen_size_update():
     signal.signal(signal.SIGWINCH, winch_trap)
 
 
-def source_script(scriptfile):
+def profile_trap(sig, frame):
     '''
-    Load a script and share variables with it
+    Signal handler for the profiler toggle signal, the profiler
+    is toggled in another thread, see `toggle_profiler`, as
+    stopping it waits for its thread and writes a file
     
-    @param  scriptfile:str  The script's pathname
+    @param  sig:int     The signal
+    @param  frame:None  Will most likely be `None`
+    '''
+    daemon_thread(toggle_profiler).start()
+
+
+def toggle_profiler(stop = False):
+    '''
+    Start the profiler if it is stopped, otherwise stop it, the samples
+    are written to the file named by `BLUESHIFT_CURSE_PROFILE`, or to a
+    file in the temporary directory, failure to write them is reported
+    
+    @param  stop:bool  Whether to only stop the profiler, if it is running
+    '''
+    global profiler
+    with profiler_lock:
+        if profiler is None:
+            if stop:
+                return
+            profiler = Profiler(os.environ.get('BLUESHIFT_CURSE_PROFILE', '') or None)
+        try:
+            if stop:
+                profiler.stop()
+            else:
+                profiler.toggle()
+        except OSError as err:
+            report('cannot write profile to %s: %s' % (profiler.pathname, err.strerror or err))
+
+
+def listen_profile_toggle():
+    '''
+    Let SIGUSR1 start and stop the profiler
+    '''
+    signal.signal(signal.SIGUSR1, profile_trap)
+
+
+def compile_script(scriptfile):
+    '''
+    Read and compile a script
+    
+    @param   scriptfile:str  The script's pathname
+    @return  :code           The compiled script
     '''
     code = None
     # Read configuration script file
@@ -213,28 +468,168 @@ def source_script(scriptfile):
     # at the end to ensure that the last line is empty.
     # If it is not, we will get errors.
     code = code.decode('utf-8', 'error') + '\n'
-    # Compile the configuration script,
-    code = compile(code, scriptfile, 'exec')
-    # and run it, with it have the same
+    # Compile the configuration script
+    return compile(code, scriptfile, 'exec')
+
+
+def source_script(scriptfile):
+    '''
+    Load a script and share variables with it
+    
+    @param  scriptfile:str  The script's pathname
+    '''
+    # Run the script with it have the same
     # globals as this module, so that it can
     # not only use want we have defined, but
     # also redefine it for us.
-    exec(code, __globals)
+    exec(compile_script(scriptfile), __globals)
 
 
-def create_client():
+def request_script(scriptfile):
     '''
-    Create IPC client connected to the IPC server
+    Load a script asynchronously, see `script_loop`
     
-    @return  :Client  The client IPC socket
+    @param  scriptfile:str  The script's pathname
     '''
-    try:
-        return Client()
-    except:
-        sys.stderr.buffer.write('Are you sure blueshift is running?\n'.encode('utf-8'))
-        sys.stderr.buffer.flush()
+    global script_thread, pending_script
+    with script_condition:
+        pending_script = scriptfile
+        if script_thread is None:
+            script_thread = daemon_thread(script_loop)
+            script_thread.start()
+        script_condition.notify()
+
+
+def rebind_globals(value, scope):
+    '''
+    Let a function, or the methods of a class, defined by a script
+    see the globals of this module, rather than the copy of them
+    that the script was executed in
+    
+    @param   value:¿V?   A value defined by the script
+    @param   scope:dict  The globals the script was executed in
+    @return  :¿V?        A copy of `value` if it is a function defined by
+                         the script, otherwise `value`, whose methods are
+                         replaced if it is a class
+    '''
+    if isinstance(value, types.FunctionType):
+        if value.__globals__ is not scope:
+            return value
+        function = types.FunctionType(value.__code__, __globals, value.__name__,
+                                      value.__defaults__, value.__closure__)
+        function.__kwdefaults__ = value.__kwdefaults__
+        function.__qualname__ = value.__qualname__
+        function.__doc__ = value.__doc__
+        function.__dict__.update(value.__dict__)
+        return function
+    if isinstance(value, type):
+        for (name, member) in list(vars(value).items()):
+            if isinstance(member, (staticmethod, classmethod)):
+                function = rebind_globals(member.__func__, scope)
+                if function is not member.__func__:
+                    setattr(value, name, type(member)(function))
+            elif isinstance(member, property):
+                accessors = [rebind_globals(f, scope) for f in (member.fget, member.fset, member.fdel)]
+                if accessors != [member.fget, member.fset, member.fdel]:
+                    setattr(value, name, property(*accessors, member.__doc__))
+            elif isinstance(member, types.FunctionType):
+                function = rebind_globals(member, scope)
+                if function is not member:
+                    setattr(value, name, function)
+            elif isinstance(member, type) and member.__qualname__.startswith(value.__qualname__ + '.'):
+                # Classes defined inside the class
+                rebind_globals(member, scope)
+    return value
+
+
+def script_loop():
+    '''
+    Load scripts requested by the server
+    
+    A script is executed in a copy of the globals of this module,
+    so that updates can continue to be processed while it runs.
+    Once it has finished, the variables it has defined or changed
+    are copied into the globals of this module, all at once.
+    If the script fails, the error is reported, see `report`.
+    If another script is requested while a script is loading,
+    only the latest request is loaded afterwards.
+    '''
+    global pending_script, script_error, status, redraw, updated
+    while True:
+        with script_condition:
+            while pending_script is None:
+                script_condition.wait()
+            (scriptfile, pending_script) = (pending_script, None)
+        try:
+            code = compile_script(scriptfile)
+            before = dict(__globals)
+            scope = dict(before)
+            exec(code, scope)
+        except Exception as err:
+            script_error = err
+            report('script %s failed: %s' % (scriptfile, err))
+            continue
+        changed = {}
+        for (key, value) in scope.items():
+            if key not in before or before[key] is not value:
+                changed[key] = rebind_globals(value, scope)
+        with condition:
+            __globals.update(changed)
+            if script_error is not None:
+                (script_error, status) = (None, None)
+            redraw = True
+            updated = True
+            condition.notify_all()
+
+
+def create_clients():
+    '''
+    Create IPC clients connected to the IPC servers, and the displays to track them
+    
+    When attached to several servers, those that cannot be connected
+    to are reported and shown as disconnected, the others are used
+    '''
+    if replay_file is not None:
+        try:
+            replay = Replay(replay_file)
+        except Exception as err:
+            printerr('%s: %s' % (PROGRAM_NAME, err))
+            sys.exit(1)
+        displays.append(Display(replay_file, Client(replay.connect(replay_paced))))
+    for name in [] if replay_file is not None else display_names or [None]:
+        try:
+            client = Client(Client.pathname(name))
+        except:
+            client = None
+        if name is None:
+            name = os.environ.get('DISPLAY', '')
+        if client is None:
+            printerr('Are you sure blueshift is running on %s?' % name)
+        else:
+            client.socket.settimeout(send_timeout)
+            if capture_file is not None:
+                pathname = capture_file
+                if len(display_names) > 1:
+                    pathname += '.' + name
+                client.capture = Capture(pathname, False)
+        displays.append(Display(name, client))
+    if not any(display.connected for display in displays):
         sys.exit(1)
-        return None
+    for display in displays:
+        if display.connected:
+            display.client.max_line = max_message
+            display.client.stream_prefixes = ('Settings: ',)
+
+
+def close_clients():
+    '''
+    Close the IPC clients and their capture logs
+    '''
+    for display in displays:
+        if display.client is not None:
+            display.client.close()
+            if display.client.capture is not None:
+                display.client.capture.close()
 
 
 def daemon_thread(target, **kwargs):
@@ -251,121 +646,420 @@ def daemon_thread(target, **kwargs):
 
 def updates_listen():
     '''
-    Listen for and read updates
+    Listen for and read updates from all servers
+    
+    All connections are multiplexed on this one thread, and only lines
+    that have already arrived are read, so a server that is slow to
+    send, or has stopped, does not delay the updates from the others
     '''
-    global blueshift_pid
-    while True:
-        message = ipc_client.read()
-        if message is None:
-            close_interface()
-        elif message.startswith('Settings: '):
-            update_settings(message[len('Settings: '):])
-        elif message.startswith('PID: '):
-            update_pid(int(message[len('PID: '):]))
-        else:
-            message = message.split(': ')
-            update_custom(message[0], ': '.join(message[1:]))
+    selector = selectors.DefaultSelector()
+    for display in displays:
+        if display.connected:
+            selector.register(display.client.socket, selectors.EVENT_READ, display)
+    while len(selector.get_map()) > 0:
+        for (key, _events) in selector.select():
+            display = key.data
+            try:
+                messages = display.client.read_available()
+            except OSError:
+                messages = None
+            if messages is None:
+                selector.unregister(key.fileobj)
+                close_display(display)
+                continue
+            for message in messages:
+                try:
+                    if isinstance(message, Fragment):
+                        receive_fragment(display, message)
+                    else:
+                        receive_message(display, message)
+                except (ValueError, SyntaxError, TypeError, KeyError):
+                    # Drop malformed messages, they must not
+                    # stop the updates from the other servers
+                    pass
+    selector.close()
+    close_interface()
+
+
+def receive_message(display, message):
+    '''
+    Act upon a message from a server
+    
+    @param  display:Display  The server that sent the message
+    @param  message:str      The message
+    '''
+    begin_message(display)
+    if message.startswith('Settings: '):
+        update_settings(message[len('Settings: '):], display)
+    elif message.startswith('Transition: '):
+        update_transition(message[len('Transition: '):], display)
+    elif message.startswith('PID: '):
+        update_pid(int(message[len('PID: '):]), display)
+    elif message.startswith('Response: '):
+        display.client.response(message[len('Response: '):])
+    elif message.startswith('Trace: '):
+        if tracer is not None:
+            display.trace_sent = int(message[len('Trace: '):])
+    else:
+        message = message.split(': ')
+        update_custom(message[0], ': '.join(message[1:]), display)
+
+
+def begin_message(display):
+    '''
+    Start tracing a message from a server, if it was stamped
+    
+    @param  display:Display  The server that sent the message
+    '''
+    if display.trace_sent is not None:
+        # The previous line stamped this message
+        display.trace_offset = tracer.begin(display.trace_sent, time.monotonic_ns())
+        display.trace_sent = None
+    else:
+        display.trace_offset = None
+
+
+def receive_fragment(display, fragment):
+    '''
+    Act upon a part of a `Settings:` message from a server
+    
+    The settings are decoded as they arrive. Before the first
+    settings from the server are complete, those that have been
+    decoded are shown. Afterwards, the previous settings are shown
+    until the new ones are complete. If the message is malformed,
+    or a setting is longer than `max_message`, it is ignored.
+    
+    @param  display:Display    The server that sent the message
+    @param  fragment:Fragment  The part of the message
+    '''
+    global updated
+    (text, end) = (fragment, fragment.end)
+    if display.decoder is None:
+        begin_message(display)
+        text = text[len('Settings: '):]
+        display.decoder = SettingsDecoder(max_message)
+        display.incoming = Settings()
+    if display.incoming is not None:
+        try:
+            settings = display.decoder.feed(text)
+            if end:
+                display.incoming.script = display.decoder.close()
+        except ValueError:
+            with condition:
+                if display.settings is display.incoming:
+                    # Do not keep showing a part of malformed settings
+                    display.settings = None
+                    updated = True
+                    condition.notify_all()
+            settings, display.incoming = [], None
+        if len(settings) > 0:
+            with condition:
+                for setting in settings:
+                    display.incoming.add_setting(setting)
+                if display.settings is None:
+                    display.settings = display.incoming
+                    updated = True
+                    condition.notify_all()
+    if end:
+        (payload, display.decoder, display.incoming) = (display.incoming, None, None)
+        if payload is not None:
+            if display.trace_offset is not None:
+                tracer.stamp(display.trace_offset, Tracer.PARSED, time.monotonic_ns())
+            apply_settings(payload, display)
+
+
+def close_display(display):
+    '''
+    Connection to a server has been closed
+    
+    @param  display:Display  The server
+    '''
+    global updated
+    with condition:
+        display.connected = False
+        updated = True
+        condition.notify_all()
+    display.client.close()
+    display.client.cancel('disconnected')
 
 
 def close_interface():
     '''
-    Connection to the server has been closed
+    Connection to all servers have been closed
     '''
+    global connected
+    with condition:
+        connected = False
+        condition.notify_all()
     sys.stdin.close()
 
 
-def update_pid(pid):
+def update_pid(pid, display):
     '''
-    The server has reported its process ID
+    A server has reported its process ID
     
-    @param  pid:int  The server's process ID
+    @param  pid:int          The server's process ID
+    @param  display:Display  The server
     '''
-    global blueshift_pid
-    blueshift_pid = pid
+    display.pid = pid
 
 
-def update_settings(payload):
+def update_settings(payload, display):
     '''
-    A new settings have been sent from the server
+    A new settings have been sent from a server
     
-    @param  payload:str  The payload part of the message
+    @param  payload:str      The payload part of the message
+    @param  display:Display  The server
     '''
-    global last_loaded_script
+    # Decoded the same way as settings that arrive in fragments
+    decoder = SettingsDecoder(max_message)
+    settings = decoder.feed(payload)
+    payload = Settings(decoder.close())
+    for setting in settings:
+        payload.add_setting(setting)
+    if display.trace_offset is not None:
+        tracer.stamp(display.trace_offset, Tracer.PARSED, time.monotonic_ns())
+    apply_settings(payload, display)
+
+
+def apply_settings(payload, display):
+    '''
+    Use new settings from a server
+    
+    @param  payload:Settings  The settings
+    @param  display:Display   The server
+    '''
+    global updated
     
-    # Parse payload
-    payload = Settings.from_repr(payload)
-    # Load new script if it has changed
-    loaded_script = not last_loaded_script == payload.script
-    if loaded_script:
-        last_loaded_script = payload.script
-        source_script(payload.script)
+    # Index the constraints of the settings, the settings
+    # are still used if they cannot be indexed
+    try:
+        display.validator.index(payload)
+    except (TypeError, ValueError) as err:
+        report('cannot index the settings: %s' % err)
+    # Load new script, in the background, if it has changed
+    if not display.script == payload.script:
+        display.script = payload.script
+        if payload.script is not None:
+            request_script(payload.script)
+    if display.trace_offset is not None:
+        tracer.stamp(display.trace_offset, Tracer.SOURCED, time.monotonic_ns())
     # Update settings
     with condition:
+        previous, display.settings = display.settings, payload
+        if previous is payload:
+            # Shown while it was being received, see `receive_fragment`
+            previous = None
+        # A value that is not on the trajectory of the setting's
+        # transition, for example after a `set`, ends the transition
+        now = time.monotonic_ns()
+        for (name, transition) in list(display.transitions.items()):
+            if name in payload and not transition.passes(payload[name].current_value, now):
+                del display.transitions[name]
+        display.history.retain(payload)
         for setting in payload.settings:
-            pass # FIXME
-        redraw = redraw or loaded_script
-        condition.notify()
+            if setting.value_type in (Setting.TYPE_INTEGER, Setting.TYPE_FLOAT):
+                if setting.current_value is not None:
+                    display.history.append(setting.name, setting.current_value)
+        updated = True
+        condition.notify_all()
+    if display.trace_offset is not None:
+        tracer.stamp(display.trace_offset, Tracer.APPLIED, time.monotonic_ns())
+    # Report changes in batch mode
+    if len(watching) > 0:
+        report_watched(previous, payload, display)
+
+
+def update_transition(payload, display):
+    '''
+    A keyframe has been sent from a server, it replaces any
+    ongoing transition of the setting
+    
+    @param  payload:str      The payload part of the message
+    @param  display:Display  The server
+    '''
+    global updated
+    transition = Transition.from_repr(payload)
+    with condition:
+        display.transitions[transition.name] = transition
+        updated = True
+        condition.notify_all()
 
 
-def update_custom(command, payload):
+def animate(display, now):
+    '''
+    Get the settings of a server with the values of settings in transition
+    interpolated, finished transitions are forgotten and their end values
+    become the current values, must be called with `condition` held
+    
+    @param   display:Display  The server
+    @param   now:int          The monotonic time, in nanoseconds
+    @return  :Settings?       The settings, `None` if none have been received
+    '''
+    (settings, transitions) = (display.settings, display.transitions)
+    if settings is None or len(transitions) == 0:
+        return settings
+    animated = Settings(settings.script)
+    for setting in settings.settings:
+        transition = transitions.get(setting.name, None)
+        if transition is not None:
+            setting = copy.copy(setting)
+            setting.current_value = transition.value_at(now)
+        animated.add_setting(setting)
+    for (name, transition) in list(transitions.items()):
+        if transition.finished(now):
+            del transitions[name]
+            if name in settings:
+                settings.set_value(name, transition.end_value)
+                display.history.append(name, transition.end_value)
+    return animated
+
+
+def update_custom(command, payload, display):
     '''
-    A non-standard command have been sent from the server
+    A non-standard command have been sent from a server
     
-    @param  command:str  The command name part of the message
-    @param  payload:str  The payload part of the message
+    @param  command:str      The command name part of the message
+    @param  payload:str      The payload part of the message
+    @param  display:Display  The server
     '''
     pass
 
 
+def request_server(command, argument = None, callback = None, targets = None):
+    '''
+    Send a request to servers without waiting for the responses
+    
+    @param   command:str                          The command
+    @param   argument:str?                        The argument of the command
+    @param   callback:(Display, bool, str)?→void  Function to invoke, once per server, with the
+                                                  server, whether the request was successful
+                                                  and the result or error description
+    @param   targets:itr<Display>?                The servers, `None` for all servers
+    @return  :int                                 The number of servers the request was sent to
+    '''
+    count = 0
+    for display in displays if targets is None else targets:
+        callback_ = None
+        if callback is not None:
+            callback_ = lambda ok, payload, display = display : callback(display, ok, payload)
+        if display.request(command, argument, callback_) is not None:
+            count += 1
+    return count
+
+
+def set_settings(values, callback = None, targets = None, snap = False):
+    '''
+    Request that settings are changed to the same values on several servers
+    
+    The values are checked against the settings of each server, all
+    at once, and only allowed values are sent. The requests are all
+    sent before any response is awaited, so one server that is slow
+    to respond does not delay the changes on the others
+    
+    @param   values:dict<str, ¿V?>                     The new values, by setting name
+    @param   callback:(Display, str, bool, str)?→void  Function to invoke, once per server and setting,
+                                                       with the server, the name of the setting, whether
+                                                       the change was successful and the result or
+                                                       error description
+    @param   targets:itr<Display>?                     The servers, `None` for all servers
+    @param   snap:bool                                 Whether to change values that are not allowed
+                                                       to the nearest allowed values, rather than
+                                                       rejecting them
+    @return  :int                                      The number of requests sent
+    '''
+    count = 0
+    for display in displays if targets is None else targets:
+        if snap:
+            (allowed, errors) = display.validator.snap(values)
+        else:
+            errors = display.validator.validate(values)
+            allowed = dict((name, value) for (name, value) in values.items() if name not in errors)
+        if callback is not None:
+            for (name, error) in errors.items():
+                callback(display, name, False, error)
+        for (name, value) in allowed.items():
+            callback_ = None
+            if callback is not None:
+                callback_ = lambda d, ok, payload, name = name : callback(d, name, ok, payload)
+            count += request_server('set', '%s %s' % (name, repr(value)), callback_, (display,))
+    return count
+
+
+def set_setting(name, value, callback = None, targets = None, snap = False):
+    '''
+    Request that a setting is changed to the same value on several servers, see `set_settings`
+    
+    @param   name:str                             The name of the setting
+    @param   value:¿V?                            The new value
+    @param   callback:(Display, bool, str)?→void  Function to invoke, once per server, with the
+                                                  server, whether the change was successful
+                                                  and the result or error description
+    @param   targets:itr<Display>?                The servers, `None` for all servers
+    @param   snap:bool                            Whether to change the value to the nearest allowed
+                                                  value if it is not allowed, rather than rejecting it
+    @return  :int                                 The number of servers the request was sent to
+    '''
+    callback_ = None
+    if callback is not None:
+        callback_ = lambda display, _name, ok, payload : callback(display, ok, payload)
+    return set_settings({ name : value }, callback_, targets, snap)
+
+
 def kill_server(sig = signal.SIGKILL):
     '''
-    Send a signal to the server process
+    Send a signal to the server processes
     
     @param  sig:int  The signal to send
     '''
-    if blueshift_pid is not None:
-        os.kill(blueshift_pid, sig)
+    for display in displays:
+        if display.pid is not None:
+            try:
+                os.kill(display.pid, sig)
+            except OSError:
+                pass
 
 
 def reload_server():
     '''
     Request that the server reloads its configuration script
     '''
-    kill_server(signal.SIGUSR1)
+    request_server('reload')
 
 
 def toggle_server():
     '''
     Request that the server temporarily removes its adjustments or recovers from such state
     '''
-    kill_server(signal.SIGUSR2)
+    request_server('toggle')
 
 
 def terminate_server():
     '''
     Request that the server removes its adjustments and stops
     '''
-    kill_server(signal.SIGTERM)
+    request_server('terminate')
 
 
 def panic_terminate_server():
     '''
     Request that the server removes its adjustments and stops immediately without transitions
     '''
-    kill_server(signal.SIGTERM)
-    kill_server(signal.SIGTERM)
+    request_server('panic')
 
 
 def pause_server():
     '''
     Cause the server process to pause until `resume_server` is invoked
     '''
-    kill_server(signal.SIGTSTP)
+    request_server('pause')
 
 
 def resume_server():
     '''
     Cause the server process to resume from an invocation of `pause_server`
+    
+    This is done with a signal as a paused server cannot read requests
     '''
     kill_server(signal.SIGCONT)
 
@@ -389,13 +1083,95 @@ def terminate_terminal():
     '''
     Terminate the terminal and restore the mode
     '''
+    global saved_stty
     # Restore terminal settings
     if saved_stty is not None:
         termios.tcsetattr(sys.stdout.fileno(), termios.TCSAFLUSH, saved_stty)
+        saved_stty = None
     # Show the cursor and terminate the terminal
     print('\033[?25h\033[?1049l', end = '', flush = True)
 
 
+def render_loop():
+    '''
+    Paint the screen whenever there is anything new to show,
+    and every `frame_interval` while any setting is in transition
+    '''
+    global redraw, updated
+    while True:
+        with condition:
+            while not updated:
+                if any(len(display.transitions) > 0 for display in displays):
+                    condition.wait(frame_interval)
+                    break
+                condition.wait()
+            full, redraw = redraw, False
+            updated = False
+            now = time.monotonic_ns()
+            current = [(display, animate(display, now), display.connected) for display in displays]
+            message = status
+        paint(current, full, message)
+        if tracer is not None:
+            tracer.paint(time.monotonic_ns())
+
+
+def paint(current, full, message = None):
+    '''
+    Paint the settings on the screen
+    
+    Each row has a setting's title and value, a slider and a sparkline.
+    When attached to several servers, the settings are grouped by name:
+    a row with the title, followed by one row per display with the value
+    
+    @param  current:list<(Display, Settings?, bool)>  Each server, its latest settings,
+                                                      and whether it is still connected
+    @param  full:bool                                 Whether to clear the screen first
+    @param  message:str?                              Message to show on the bottom row, if any
+    '''
+    rows = []
+    if len(current) == 1:
+        (display, settings, _connected) = current[0]
+        for setting in [] if settings is None else settings.settings:
+            label = '%s: %s' % (setting.title, setting.current_value)
+            rows.append((label, setting, display.history))
+    else:
+        groups = {}
+        for (display, settings, connected) in current:
+            for setting in [] if settings is None else settings.settings:
+                if setting.name not in groups:
+                    groups[setting.name] = (setting.title, [])
+                groups[setting.name][1].append((display, setting, connected))
+        for (title, members) in groups.values():
+            rows.append((title, None, None))
+            for (display, setting, connected) in members:
+                if connected:
+                    label = '  %s: %s' % (display.name, setting.current_value)
+                    rows.append((label, setting, display.history))
+                else:
+                    rows.append(('  %s: disconnected' % display.name, None, None))
+    
+    buf = [b'\033[H\033[2J' if full else b'']
+    label_width = width * 2 // 5
+    slider_width = width // 4
+    spark_width = width - label_width - slider_width - 2
+    for (row, (label, setting, history)) in enumerate(rows[:height - 1]):
+        buf.append(b'\033[%i;1H' % (row + 1))
+        buf.append(label[:label_width].ljust(label_width).encode('utf-8'))
+        if setting is not None:
+            if slider_width > 0:
+                buf.append(b' ' + widgets.slider(setting, slider_width))
+            if spark_width > 0 and setting.value_type in (Setting.TYPE_INTEGER, Setting.TYPE_FLOAT):
+                spark = history.sparkline(setting.name, min(history.capacity, spark_width),
+                                          setting.minimum, setting.maximum)
+                buf.append((' ' + spark).encode('utf-8'))
+        buf.append(b'\033[K')
+    buf.append(b'\033[%i;1H' % height)
+    buf.append(('' if message is None else message)[:width - 1].encode('utf-8'))
+    buf.append(b'\033[K')
+    sys.stdout.buffer.write(b''.join(buf))
+    sys.stdout.buffer.flush()
+
+
 def read_input():
     '''
     Read from the terminal and act upon the input
@@ -415,29 +1191,252 @@ def run():
     '''
     Run the user interface
     '''
-    global ipc_client, updates_thread
+    global updates_thread, render_thread, tracer
+    
+    trace_file = os.environ.get('BLUESHIFT_CURSE_TRACE', '')
+    if not trace_file == '':
+        tracer = Tracer()
     
     update_size()
     listen_size_update()
+    listen_profile_toggle()
     
-    ipc_client = create_client()
+    create_clients()
     try:
         updates_thread = daemon_thread(updates_listen)
         updates_thread.start()
         
         try:
             initialise_terminal()
+            render_thread = daemon_thread(render_loop)
+            render_thread.start()
             read_input()
         finally:
             terminate_terminal()
     finally:
-        ipc_client.close()
+        close_clients()
+        if tracer is not None:
+            tracer.dump(trace_file)
+        toggle_profiler(stop = True)
+
+
+def batch_output(line, display = None):
+    '''
+    Write a result line in batch mode
+    
+    @param  line:str          The line
+    @param  display:Display?  The server the result is from, if any, the line
+                              is prefixed by its name when attached to several
+    '''
+    if display is not None and len(displays) > 1:
+        line = '%s %s' % (display.name, line)
+    with output_lock:
+        print(line)
+
+
+def report_watched(previous, current, display):
+    '''
+    Report the watched settings that have changed in batch mode
+    
+    @param  previous:Settings?  The settings before the update, `None` to report all watched settings
+    @param  current:Settings    The settings after the update
+    @param  display:Display     The server the settings are from
+    '''
+    for setting in current.select(watching).settings:
+        if previous is not None and setting.name in previous:
+            if previous[setting.name].current_value == setting.current_value:
+                continue
+        batch_output('value %s %s' % (setting.name, repr(setting.current_value)), display)
+
+
+def batch_callback(description):
+    '''
+    Create a function that reports the result of a request in batch mode
+    
+    @param   description:str             How to refer to the request in the results
+    @return  :(Display, bool, str)→void  Function to invoke with the server, whether the request
+                                         was successful and the result or error description
+    '''
+    def callback(display, ok, payload):
+        if ok and payload:
+            batch_output('ok %s: %s' % (description, payload), display)
+        elif ok:
+            batch_output('ok %s' % description, display)
+        else:
+            batch_output('error %s: %s' % (description, payload), display)
+        with condition:
+            condition.notify_all()
+    return callback
+
+
+def batch_request(description, command, argument = None):
+    '''
+    Send a request to all servers in batch mode, reporting the results when they arrive
+    
+    @param  description:str  How to refer to the request in the results
+    @param  command:str      The command
+    @param  argument:str?    The argument of the command
+    '''
+    request_server(command, argument, batch_callback(description))
+
+
+def batch_settings():
+    '''
+    Wait until the settings of all servers have been received in batch mode
+    '''
+    with condition:
+        # Settings that are still being received may be incomplete
+        while connected and any(d.connected and d.settings in (None, d.incoming) for d in displays):
+            condition.wait()
+
+
+def batch_command(line):
+    '''
+    Execute a command in batch mode
+    
+    @param  line:str  The command line
+    '''
+    words = line.split()
+    if len(words) == 0:
+        return
+    (command, args) = (words[0], words[1:])
+    if command == 'get':
+        batch_settings()
+        with condition:
+            now = time.monotonic_ns()
+            current = [(display, animate(display, now)) for display in displays]
+        for (display, settings) in current:
+            for name in args:
+                if settings is not None and name in settings:
+                    batch_output('value %s %s' % (name, repr(settings[name].current_value)), display)
+                elif settings is None:
+                    batch_output('error get %s: not connected' % name, display)
+                else:
+                    batch_output('error get %s: unknown setting' % name, display)
+    elif command == 'set':
+        if len(args) < 2:
+            batch_output('error set: usage: set NAME VALUE')
+        else:
+            value = line.split(None, 2)[2]
+            try:
+                value = ast.literal_eval(value)
+            except (SyntaxError, ValueError):
+                batch_output('error set %s: malformed value' % args[0])
+                return
+            batch_settings()
+            set_setting(args[0], value, batch_callback('set %s' % args[0]))
+    elif command == 'watch':
+        watching.extend(args)
+        for display in displays:
+            settings = display.settings
+            if settings is not None:
+                report_watched(None, settings.select(args), display)
+    elif command == 'unwatch':
+        for pattern in args:
+            while pattern in watching:
+                watching.remove(pattern)
+        with condition:
+            condition.notify_all()
+    elif command in ('reload', 'toggle', 'terminate', 'panic', 'pause'):
+        batch_request(command, command)
+    elif command == 'profile':
+        batch_request(command, command, ' '.join(args) or None)
+    elif command == 'resume':
+        resume_server()
+        batch_output('ok resume')
+    else:
+        batch_output('error %s: unknown command' % command)
+
+
+def batch_input():
+    '''
+    Read and execute commands from the standard input in batch mode
+    '''
+    global batch_input_done
+    try:
+        for line in sys.stdin.buffer:
+            batch_command(line.decode('utf-8', 'replace').rstrip('\n'))
+    except (OSError, ValueError):
+        pass
+    with condition:
+        batch_input_done = True
+        condition.notify_all()
 
 
+def run_batch():
+    '''
+    Run non-interactively
+    
+    Commands are read, one per line, from the standard input:
+    
+        get NAME...              Report the current values of settings
+        set NAME VALUE           Request that a setting is changed,
+                                 the value is written as a Python literal,
+                                 and must be allowed by the setting
+        watch PATTERN...         Report the values of matching settings
+                                 now and whenever they change
+        unwatch PATTERN...       Stop watching settings
+        reload, toggle, terminate, panic, pause, resume
+                                 Control the server
+        profile [start | stop]   Start, stop or toggle the server's profiler
+    
+    Results are written, one per line, to the standard output as they
+    become available: `value NAME VALUE`, `ok COMMAND`, `ok COMMAND: REPLY`
+    or `error COMMAND: MESSAGE`. Requests are pipelined, so results of `set` and control
+    commands can arrive after later results. When attached to several
+    servers, requests are sent to all of them, and results from a server
+    are prefixed by its display and a space. The program exits when all
+    servers have disconnected, or when the input has ended, all requests
+    have been answered and no settings are watched.
+    '''
+    global updates_thread
+    
+    listen_profile_toggle()
+    create_clients()
+    try:
+        updates_thread = daemon_thread(updates_listen)
+        updates_thread.start()
+        daemon_thread(batch_input).start()
+        with condition:
+            while connected:
+                if batch_input_done and len(watching) == 0:
+                    if all(len(d.client.pending) == 0 for d in displays if d.client is not None):
+                        break
+                condition.wait()
+    finally:
+        close_clients()
+        toggle_profiler(stop = True)
+
+
+## Parse command line
+config_file = None
+conf_opts = []
+args = sys.argv[1:]
+while len(args) > 0:
+    arg = args.pop(0)
+    if arg == '--batch':
+        batch_mode = True
+    elif arg in ('-c', '--configurations', '-d', '--display', '--capture', '--replay', '--replay-fast'):
+        if len(args) == 0:
+            printerr('%s: %s requires an argument' % (PROGRAM_NAME, arg))
+            sys.exit(1)
+        if arg in ('-d', '--display'):
+            display_names.append(args.pop(0))
+        elif arg == '--capture':
+            capture_file = args.pop(0)
+        elif arg.startswith('--replay'):
+            replay_file = args.pop(0)
+            replay_paced = arg == '--replay'
+        else:
+            config_file = args.pop(0)
+    elif arg == '--':
+        conf_opts += args
+        break
+    else:
+        conf_opts.append(arg)
+
 ## Make dictionary of globals that sources scripts should use
-__globals, __locals = globals(), dict(locals())
-for key in l:
-    __globals[key] = __locals[key]
+__globals = globals()
 
 ## Load extension and configurations via blueshift-curserc
 # No configuration script has been selected explicitly,
@@ -489,5 +1488,8 @@ if config_file is not None:
     source_script(config_file)
 
 
-run()
+if batch_mode:
+    run_batch()
+else:
+    run()
 
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import sys
+import time
+import socket
+import argparse
+import threading
+from array import array
+
+from client import Client
+
+
+class Receiver:
+    '''
+    Connection measuring the delivery of broadcasts
+    
+    @variable  client:Client     The connection
+    @variable  latencies:array   The delivery latency, in nanoseconds, of each received broadcast
+    @variable  received:int      The number of received broadcasts
+    @variable  lost:int          The number of broadcasts missing between received broadcasts
+    @variable  sequence:int?     The number of the last received broadcast
+    '''
+    
+    def __init__(self, sockfile, patterns):
+        '''
+        Constructor
+        
+        @param  sockfile:str?        The pathname of the socket
+        @param  patterns:list<str>?  The settings to subscribe to, `None` for all
+        '''
+        self.client = Client(sockfile)
+        if patterns:
+            self.client.subscribe(*patterns)
+        self.latencies = array('q')
+        self.received = 0
+        self.lost = 0
+        self.sequence = None
+    
+    
+    def run(self):
+        '''
+        Read from the connection until it is closed
+        '''
+        sent = None
+        try:
+            while True:
+                message = self.client.read()
+                if message is None:
+                    break
+                if message.startswith('Trace: '):
+                    sent = int(message[len('Trace: '):])
+                elif message.startswith('Settings: '):
+                    if sent is not None:
+                        self.latencies.append(time.monotonic_ns() - sent)
+                        sent = None
+                elif message.startswith('Sequence: '):
+                    sequence = int(message[len('Sequence: '):])
+                    if self.sequence is not None:
+                        self.lost += max(0, sequence - self.sequence - 1)
+                    self.sequence = sequence
+                    self.received += 1
+        except OSError:
+            pass
+    
+    
+    def close(self):
+        '''
+        Disconnect
+        '''
+        try:
+            self.client.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.client.close()
+
+
+def percentile(values, fraction):
+    '''
+    Get a percentile of sorted values
+    
+    @param   values:list<int>  The values, sorted
+    @param   fraction:float    The percentile, as a fraction
+    @return  :int              The value at the percentile
+    '''
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main(args = None):
+    '''
+    Run the load generator
+    
+    The server must have tracing enabled and follow each broadcast
+    with a `Sequence:` line, as the stand-in server does.
+    
+    @param  args:list<str>?  Command line arguments, `None` for `sys.argv[1:]`
+    '''
+    parser = argparse.ArgumentParser(prog = 'loadgen', description = 'Load generator for blueshift-curse servers')
+    parser.add_argument('--socket', default = None, help = 'socket pathname, the current display\'s by default')
+    parser.add_argument('--clients', type = int, default = 200, help = 'number of connections')
+    parser.add_argument('--duration', type = float, default = 10.0, help = 'seconds to measure')
+    parser.add_argument('--subscribe', action = 'append', metavar = 'PATTERN', help = 'setting name or glob pattern to subscribe to')
+    args = parser.parse_args(args)
+    
+    receivers = [Receiver(args.socket, args.subscribe) for _ in range(args.clients)]
+    threads = []
+    for receiver in receivers:
+        thread = threading.Thread(target = receiver.run)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    
+    time.sleep(args.duration)
+    for receiver in receivers:
+        receiver.close()
+    for thread in threads:
+        thread.join()
+    
+    latencies = sorted(latency for receiver in receivers for latency in receiver.latencies)
+    received = sum(receiver.received for receiver in receivers)
+    lost = sum(receiver.lost for receiver in receivers)
+    out = 'clients:   %i\n' % args.clients
+    out += 'received:  %i\n' % received
+    out += 'lost:      %i (%.3f %%)\n' % (lost, 100 * lost / max(1, lost + received))
+    if len(latencies) > 0:
+        out += 'latency:   min %.3f ms, median %.3f ms, p99 %.3f ms, max %.3f ms\n' % (
+            latencies[0] / 1e6, percentile(latencies, 0.5) / 1e6,
+            percentile(latencies, 0.99) / 1e6, latencies[-1] / 1e6)
+    sys.stdout.buffer.write(out.encode('utf-8'))
+    sys.stdout.buffer.flush()
+
+
+if __name__ == '__main__':
+    main()
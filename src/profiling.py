@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import sys
+import tempfile
+import threading
+
+
+class Profiler:
+    '''
+    Sampling profiler that can be started and stopped at runtime
+    
+    While running, a thread samples the stacks of all other threads
+    at a fixed interval. Nothing is hooked into the profiled code, so
+    when the profiler is stopped it costs nothing at all. When stopped,
+    the samples are written in the collapsed stack format, one line
+    per distinct stack, the thread's name and the functions from the
+    outermost inwards separated by semicolons, followed by the number
+    of samples, which can be read by flame graph tools.
+    
+    @variable  pathname:str             The file the samples are written to when stopped
+    @variable  fd:int?                  The file descriptor of `pathname`, if it was created
+                                        by the profiler, otherwise it is opened when stopped
+    @variable  interval:float           The number of seconds between samples
+    @variable  samples:dict<str, int>?  The number of samples of each stack, `None` if never started
+    '''
+    
+    def __init__(self, pathname = None, interval = 0.005):
+        '''
+        Constructor
+        
+        @param  pathname:str?   The file the samples are written to when stopped,
+                                `None` for a new file in the temporary directory
+                                named after the program and process ID
+        @param  interval:float  The number of seconds between samples
+        '''
+        self.fd = None
+        if pathname is None:
+            # Create the file exclusively, so that another user
+            # cannot have it be written through a symbolic link
+            program = os.path.basename(sys.argv[0]).split('.')[0]
+            (self.fd, pathname) = tempfile.mkstemp('.folded', '%s-%i-' % (program, os.getpid()))
+        self.pathname = pathname
+        self.interval = interval
+        self.samples = None
+        self.thread = None
+        self.stopping = threading.Event()
+    
+    
+    def running(self):
+        '''
+        Check whether the profiler is running
+        
+        @return  :bool  Whether the profiler is running
+        '''
+        return self.thread is not None
+    
+    
+    def start(self):
+        '''
+        Start sampling, the samples from any earlier run are discarded
+        '''
+        if self.thread is not None:
+            return
+        self.samples = {}
+        self.stopping.clear()
+        self.thread = threading.Thread(target = self.sample_loop)
+        self.thread.setDaemon(True)
+        self.thread.start()
+    
+    
+    def stop(self):
+        '''
+        Stop sampling and write the samples to `pathname`
+        '''
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        if self.fd is None:
+            file = open(self.pathname, 'wb')
+        else:
+            os.ftruncate(self.fd, 0)
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            file = os.fdopen(os.dup(self.fd), 'wb')
+        with file:
+            for (stack, count) in sorted(self.samples.items()):
+                file.write(('%s %i\n' % (stack, count)).encode('utf-8'))
+    
+    
+    def toggle(self):
+        '''
+        Start the profiler if it is stopped, otherwise stop it
+        
+        @return  :bool  Whether the profiler is running now
+        '''
+        if self.running():
+            self.stop()
+        else:
+            self.start()
+        return self.running()
+    
+    
+    def sample_loop(self):
+        '''
+        Sample the stacks of all other threads until stopped
+        '''
+        samples, me = self.samples, threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%i)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack = ';'.join(reversed(stack))
+                samples[stack] = samples.get(stack, 0) + 1
@@ -17,42 +17,113 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import ast
+import time
+import signal
 import threading
+from fnmatch import fnmatchcase
+from collections import deque
 
 from dsocket import DSocket
+from profiling import Profiler
+from validation import Validator
 
 
 class Server:
     '''
     Blueshift-curse server
+    
+    The registry of clients and their subscriptions are replaced, never
+    modified, when clients connect, disconnect or subscribe, so they can
+    be iterated without locking. `lock` is only held while replacing them.
+    Messages from clients are queued under `condition`, which is not
+    used for anything else. `publish_lock` is held while the settings
+    or a keyframe are replaced, and while a new client is registered,
+    but never while sending. Instead, each of them is numbered, and a
+    client is never sent settings, or a keyframe of a setting, older
+    than those it has already been sent, see `publish`, so a new client
+    cannot receive older settings after newer ones. Broadcasts never
+    wait for `lock`, which is held by threads reading from clients when
+    they disconnect.
+    
+    The constraints of the broadcasted settings are indexed, and the
+    values of `set` requests, whose argument is the name of a setting
+    and a Python literal separated by a space, are checked against
+    them before the requests reach the handler, see `check_requests`.
+    
+    @variable  clients:tuple<DSocket>                   The connected clients
+    @variable  handlers:dict<str, (Request)→str?>        Request handlers by command
+    @variable  subscriptions:dict<DSocket, tuple<str>>  The setting name patterns each client has
+                                                        subscribed to, absent for all settings
+    @variable  settings:Settings?                       The last broadcasted settings, sent to new clients
+    @variable  transitions:dict<str, Transition>        The last broadcasted keyframe of each setting,
+                                                        unfinished ones are sent to new clients
+    @variable  published:int                            The number of settings and keyframes broadcasted
+    @variable  sequences:dict<str?, int>                The number, see `published`, of `settings`,
+                                                        under `None`, and of each of the `transitions`
+    @variable  validator:Validator                      Validator of values of `settings`
+    @variable  max_message:int?                         The maximum length of a message from a client, longer
+                                                        messages are discarded, `None` for no limit
+    @variable  profiler:Profiler?                       The profiler, `None` until the `profile` command is used
+    @variable  capture:Capture?                         Log to record the traffic of clients that connect
+                                                        in, `None` if not capturing
+    @variable  connections:int                          The number of clients that have connected
     '''
     
-    def __init__(self):
+    CONTROL = { 'reload'    : (signal.SIGUSR1,)
+              , 'toggle'    : (signal.SIGUSR2,)
+              , 'terminate' : (signal.SIGTERM,)
+              , 'panic'     : (signal.SIGTERM, signal.SIGTERM)
+              , 'pause'     : (signal.SIGTSTP,)
+              }
+    '''
+    :dict<str, tuple<int>>  The signals the server process sends itself for each control request
+    '''
+    
+    def __init__(self, trace = False, sockfile = None):
         '''
         Constructor
+        
+        @param  trace:bool     Whether to stamp messages with the time they are sent
+        @param  sockfile:str?  The pathname of the socket, `None` for the one
+                               of the blueshift instance on the current display
         '''
-        self.sockfile = '/dev/shm/.blueshift-curse-%s~%s'
-        self.sockfile %= (os.environ['DISPLAY'], os.environ['USER'])
+        if sockfile is None:
+            sockfile = '/dev/shm/.blueshift-curse-%s~%s'
+            sockfile %= (os.environ['DISPLAY'], os.environ['USER'])
+        self.sockfile = sockfile
         self.socket = DSocket(self.sockfile, True)
-        self.clients = []
-        self.semaphore = threading.Semaphore()
-        self.condition = None
-        self.inqueue = None
+        self.clients = ()
+        self.lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.inqueue = deque()
         self.reading = False
+        self.trace = trace
+        self.handlers = dict((command, self.control) for command in Server.CONTROL)
+        self.handlers['profile'] = self.profile
+        self.subscriptions = {}
+        self.settings = None
+        self.transitions = {}
+        self.published = 0
+        self.sequences = {}
+        self.validator = Validator()
+        self.profiler = None
+        self.max_message = 1 << 16
+        self.capture = None
+        self.connections = 0
     
     
     def close(self):
         '''
-        Close the socket
+        Close the socket, and the capture log, if any
         '''
         self.socket.close()
-        self.semaphore.acquire():
-        try:
-            for client in self.client:
-                client.close()
-        finally:
-            self.semaphore.release()
+        for client in self.clients:
+            client.close()
         os.unlink(self.sockfile)
+        if self.capture is not None:
+            self.capture.close()
     
     
     def async_read(self, client):
@@ -63,20 +134,17 @@ class Server:
         '''
         def async_read_():
             while True:
-                line = client.read()
+                try:
+                    line = client.read()
+                except Exception:
+                    # Whatever the client sent, stop reading from it
+                    line = None
                 if line is None:
                     break
-                self.condition.acquire()
-                try:
+                with self.condition:
                     self.inqueue.append((line, client))
                     self.condition.notify()
-                finally:
-                    self.condition.release()
-            self.semaphore.acquire()
-            try:
-                del self.clients[self.clients.index(client)]
-            finally:
-                self.semaphore.release()
+            self.remove_client(client)
         thread = threading.Thread(target = async_read_)
         thread.setDaemon(False)
         thread.start()
@@ -91,13 +159,27 @@ class Server:
         @return  :Thread                 The created thread
         '''
         def target_(socket):
-            self.semaphore.acquire()
-            try:
-                self.clients.append(socket)
-                if self.reading:
-                    self.async_read(socket)
-            finally:
-                self.semaphore.release()
+            socket.capture = self.capture
+            socket.max_line = self.max_message
+            socket.published = {}
+            socket.publish_lock = threading.Lock()
+            with self.publish_lock:
+                with self.lock:
+                    self.connections += 1
+                    socket.connection = self.connections
+                    self.clients = self.clients + (socket,)
+                    if self.reading:
+                        self.async_read(socket)
+                (settings, transitions, sequences) = (self.settings, self.transitions, self.sequences)
+            # Broadcasts made since the client was registered
+            # are newer, and are not replaced by these
+            if settings is not None:
+                self.publish(settings.encode(), socket, None, sequences[None])
+            now = time.monotonic_ns()
+            for (name, transition) in transitions.items():
+                if not transition.finished(now):
+                    data = ('Transition: %s\n' % repr(transition)).encode('utf-8')
+                    self.publish(data, socket, name, sequences[name])
             if target is not None:
                 target(socket)
         return self.socket.listen(target_)
@@ -111,37 +193,298 @@ class Server:
         
         @return  :(str, DSocket)  The message received and which client send the message
         '''
-        self.semaphore.acquire()
-        try:
-            if not self.reading:
-                self.reading = True
-                self.condition = threading.Condition()
-                self.inqueue = []
-                for client in self.clients:
-                    self.async_read(client)
-        finally:
-            self.semaphore.release()
-        self.condition.acquire()
-        try:
-            self.condition.wait()
-            self.semaphore.acquire()
-            try:
-                rc, self.inqueue[:] = self.inqueue[-1], self.inqueue[:-1]
-            finally:
-                self.semaphore.release()
-        finally:
-            self.condition.release()
+        if not self.reading:
+            with self.lock:
+                if not self.reading:
+                    self.reading = True
+                    for client in self.clients:
+                        self.async_read(client)
+        with self.condition:
+            while len(self.inqueue) == 0:
+                self.condition.wait()
+            return self.inqueue.popleft()
+    
+    
+    def read_all(self):
+        '''
+        Wait for messages from any client, like `read`, and
+        return all messages that have been received
+        
+        @return  :list<(str, DSocket)>  The messages received and which clients sent them
+        '''
+        rc = [self.read()]
+        with self.condition:
+            rc.extend(self.inqueue)
+            self.inqueue.clear()
+        return rc
+    
+    
+    def dispatch(self, line, client):
+        '''
+        Act upon a message from a client if it is a request or a subscription
+        
+        A `Subscribe:` message replaces the client's subscription with the
+        space-separated setting names or glob patterns in its payload, an
+        empty payload subscribes the client to all settings.
+        
+        The handler of the request's command is invoked with the request,
+        unless it is a `set` request with a value that is not allowed,
+        see `check_requests`.
+        Unless the handler has replied or deferred the request, the value
+        it returns is sent as the reply. A handler that defers the request
+        must reply later, possibly after replying to later requests.
+        
+        @param   line:str        The message
+        @param   client:DSocket  The client that sent the message
+        @return  :bool           Whether the message was a request or a subscription
+        '''
+        if line.startswith('Subscribe: '):
+            self.subscribe(client, line[len('Subscribe: '):].split())
+            return True
+        if not line.startswith('Request: '):
+            return False
+        request = Request.from_line(line[len('Request: '):], client, self)
+        if request is not None and len(self.check_requests([request])) > 0:
+            self.handle(request)
+        return True
+    
+    
+    def dispatch_all(self, messages):
+        '''
+        Act upon messages from clients, in order, like `dispatch`, except
+        that the values of all `set` requests among them are checked at once
+        
+        @param   messages:list<(str, DSocket)>  The messages and the clients that sent them
+        @return  :list<(str, DSocket)>          The messages that were neither requests
+                                                nor subscriptions, and their clients
+        '''
+        (rc, requests) = ([], {})
+        for (i, (line, client)) in enumerate(messages):
+            if line.startswith('Request: '):
+                requests[i] = Request.from_line(line[len('Request: '):], client, self)
+        checked = set(self.check_requests([r for r in requests.values() if r is not None]))
+        for (i, (line, client)) in enumerate(messages):
+            if i in requests:
+                if requests[i] in checked:
+                    self.handle(requests[i])
+            elif not self.dispatch(line, client):
+                rc.append((line, client))
         return rc
     
     
+    def check_requests(self, requests):
+        '''
+        Fail the `set` requests whose values are not allowed
+        by the last broadcasted settings, all are allowed if
+        no settings have been broadcasted
+        
+        @param   requests:list<Request>  The requests
+        @return  :list<Request>          The requests that have not been failed
+        '''
+        if self.settings is None:
+            return requests
+        (rc, rounds) = ([], [])
+        for request in requests:
+            if not request.command == 'set':
+                rc.append(request)
+                continue
+            (name, value) = ((request.argument or '').split(' ', 1) + [''])[:2]
+            try:
+                value = ast.literal_eval(value)
+            except (SyntaxError, ValueError):
+                request.fail('malformed value: %s' % value)
+                continue
+            # Each setting appears at most once in a round
+            for round_ in rounds:
+                if name not in round_:
+                    break
+            else:
+                round_ = {}
+                rounds.append(round_)
+            round_[name] = (request, value)
+        for round_ in rounds:
+            errors = self.validator.validate(dict((name, value) for (name, (_, value)) in round_.items()))
+            for (name, error) in errors.items():
+                round_[name][0].fail('%s: %s' % (name, error))
+        return [request for request in requests if not request.replied]
+    
+    
+    def handle(self, request):
+        '''
+        Invoke the handler of a request's command, and reply with
+        the value it returns, see `dispatch`
+        
+        @param  request:Request  The request
+        '''
+        if request.command not in self.handlers:
+            request.fail('unknown command: %s' % request.command)
+            return
+        try:
+            rc = self.handlers[request.command](request)
+        except Exception as err:
+            if not request.replied:
+                request.fail(str(err))
+            return
+        if not (request.replied or request.deferred):
+            request.reply('' if rc is None else str(rc))
+    
+    
+    def serve(self, target = None):
+        '''
+        Read and dispatch requests from all clients asynchronously
+        
+        @param   target:(str, DSocket)?→void  The function to invoke with messages
+                                              that are not requests, and the client
+                                              that sent them
+        @return  :Thread                      The created thread
+        '''
+        def serve_():
+            while True:
+                for (line, client) in self.dispatch_all(self.read_all()):
+                    if target is not None:
+                        target(line, client)
+        thread = threading.Thread(target = serve_)
+        thread.setDaemon(True)
+        thread.start()
+        return thread
+    
+    
+    def control(self, request):
+        '''
+        Request handler for control commands, the server process
+        sends itself the signals that it used to receive from clients
+        
+        @param  request:Request  The request
+        '''
+        request.reply()
+        for sig in Server.CONTROL[request.command]:
+            os.kill(os.getpid(), sig)
+    
+    
+    def profile(self, request):
+        '''
+        Handle a request to start or stop the profiler, the argument is
+        `start` or `stop`, no argument toggles the profiler. The reply
+        is `on` or `off`, followed by the output file, which is always
+        in the temporary directory, so that clients cannot choose which
+        files the server writes
+        
+        @param   request:Request  The request
+        @return  :str             The reply
+        '''
+        action = request.argument or ''
+        running = self.profiler is not None and self.profiler.running()
+        if action == '':
+            action = 'stop' if running else 'start'
+        if action not in ('start', 'stop'):
+            raise Exception('usage: profile [start | stop]')
+        if action == 'start' and not running:
+            if self.profiler is None:
+                self.profiler = Profiler()
+            self.profiler.start()
+        elif action == 'stop' and running:
+            self.profiler.stop()
+        if self.profiler is None:
+            return 'off'
+        return '%s %s' % ('on' if self.profiler.running() else 'off', self.profiler.pathname)
+    
+    
+    def subscribe(self, client, patterns):
+        '''
+        Set which settings a client receives in `broadcast_settings`
+        
+        @param  client:DSocket       The client
+        @param  patterns:list<str>?  Setting names or glob patterns, empty or `None` for all settings
+        '''
+        with self.lock:
+            subscriptions = dict(self.subscriptions)
+            if patterns:
+                subscriptions[client] = tuple(sorted(set(patterns)))
+            else:
+                subscriptions.pop(client, None)
+            self.subscriptions = subscriptions
+    
+    
+    def broadcast_settings(self, settings):
+        '''
+        Send settings to all clients, each client only receives the
+        settings it has subscribed to. The message is only encoded
+        once for each distinct subscription, and the settings are
+        remembered and sent to clients as they connect.
+        
+        @param  settings:Settings  The settings
+        '''
+        with self.publish_lock:
+            self.validator.index(settings)
+            self.published += 1
+            sequence = self.published
+            self.settings = settings
+            self.sequences = dict(self.sequences)
+            self.sequences[None] = sequence
+            (clients, subscriptions) = (self.clients, self.subscriptions)
+        for client in clients:
+            self.publish(settings.encode(subscriptions.get(client, None)), client, None, sequence)
+    
+    
+    def broadcast_transition(self, transition):
+        '''
+        Send a keyframe to the clients that have subscribed to its setting,
+        unless it describes the same trajectory as the last keyframe sent
+        for the setting, so it is safe to call for every step of a transition
+        
+        @param   transition:Transition  The keyframe
+        @return  :bool                  Whether the keyframe was sent
+        '''
+        name = transition.name
+        with self.publish_lock:
+            if self.transitions.get(name, None) == transition:
+                return False
+            now = time.monotonic_ns()
+            transitions = dict((key, value) for (key, value) in self.transitions.items()
+                               if not value.finished(now))
+            transitions[name] = transition
+            self.published += 1
+            sequence = self.published
+            sequences = dict((key, value) for (key, value) in self.sequences.items()
+                             if key is None or key in transitions)
+            sequences[name] = sequence
+            (self.transitions, self.sequences) = (transitions, sequences)
+            (clients, subscriptions) = (self.clients, self.subscriptions)
+        data = ('Transition: %s\n' % repr(transition)).encode('utf-8')
+        for client in clients:
+            patterns = subscriptions.get(client, None)
+            if patterns is None or any(fnmatchcase(name, pattern) for pattern in patterns):
+                self.publish(data, client, name, sequence)
+        return True
+    
+    
+    def publish(self, data, target, key, sequence):
+        '''
+        Send settings or a keyframe to a client, unless
+        it has already been sent newer settings or a newer
+        keyframe of the same setting
+        
+        @param  data:bytes      The message, UTF-8 encoded, including its line break
+        @param  target:DSocket  The client
+        @param  key:str?        The name of the setting, `None` for settings
+        @param  sequence:int    The number of the settings or keyframe, see `published`
+        '''
+        with target.publish_lock:
+            if target.published.get(key, 0) >= sequence:
+                return
+            target.published[key] = sequence
+            self.send(data, target)
+    
+    
     def broadcast(self, text):
         '''
         Broadcast a message to all clients
         
         @param  text:str  The text line to send
         '''
-        for client in list(self.client):
-            self.write(text, client)
+        data = (text + '\n').encode('utf-8')
+        for client in self.clients:
+            self.send(data, client)
     
     
     def write(self, text, target):
@@ -151,19 +494,52 @@ class Server:
         @param  text:str         The text line to send
         @param  target:DSocket?  The client, `None` for all
         '''
-        if self.target is None:
+        if target is None:
             self.broadcast(text)
         else:
-            try:
-                target.write(text)
-            except:
-                try:
-                    self.semaphore.acquire()
-                    del self.clients[self.clients.index(target)]
-                except:
-                    pass
-                finally:
-                    self.semaphore.release()
+            self.send((text + '\n').encode('utf-8'), target)
+    
+    
+    def send(self, data, target):
+        '''
+        Send encoded messages to a client
+        
+        If tracing is enabled, the messages are preceded by a
+        `Trace:` line with the monotonic time, in nanoseconds,
+        at which the messages were sent
+        
+        @param  data:bytes      The text lines, UTF-8 encoded, including their line breaks
+        @param  target:DSocket  The client
+        '''
+        try:
+            if self.trace:
+                data = b'Trace: %i\n' % time.monotonic_ns() + data
+            target.send(data)
+        except:
+            # Do not wait for the lock, if it is busy, the client
+            # is removed by its reader thread or the next failure
+            self.remove_client(target, False)
+    
+    
+    def remove_client(self, client, wait = True):
+        '''
+        Forget a client that has disconnected
+        
+        @param   client:DSocket  The client
+        @param   wait:bool       Whether to wait if the registry is being replaced
+        @return  :bool           Whether the client was removed
+        '''
+        if not self.lock.acquire(wait):
+            return False
+        try:
+            self.clients = tuple(c for c in self.clients if c is not client)
+            if client in self.subscriptions:
+                subscriptions = dict(self.subscriptions)
+                del subscriptions[client]
+                self.subscriptions = subscriptions
+        finally:
+            self.lock.release()
+        return True
     
     
     def __enter__(self):
@@ -179,3 +555,94 @@ class Server:
         '''
         self.close()
 
+
+class Request:
+    '''
+    Request from a client
+    
+    @variable  id:str           The client-chosen ID of the request
+    @variable  command:str      The command
+    @variable  argument:str?    The argument of the command, `None` if omitted
+    @variable  client:DSocket   The client that sent the request
+    @variable  server:Server    The server that received the request
+    @variable  replied:bool     Whether the request has been replied to
+    @variable  deferred:bool    Whether the request will be replied to later
+    '''
+    
+    def __init__(self, id, command, argument, client, server):
+        '''
+        Constructor
+        
+        @param  id:str          The client-chosen ID of the request
+        @param  command:str     The command
+        @param  argument:str?   The argument of the command, `None` if omitted
+        @param  client:DSocket  The client that sent the request
+        @param  server:Server   The server that received the request
+        '''
+        self.id       = id
+        self.command  = command
+        self.argument = argument
+        self.client   = client
+        self.server   = server
+        self.replied  = False
+        self.deferred = False
+    
+    
+    def defer(self):
+        '''
+        Declare that the request will be replied to later
+        '''
+        self.deferred = True
+    
+    
+    def reply(self, payload = ''):
+        '''
+        Send a successful response
+        
+        @param  payload:str  The result
+        '''
+        self.respond('ok', payload)
+    
+    
+    def fail(self, message):
+        '''
+        Send an unsuccessful response
+        
+        @param  message:str  Description of the error
+        '''
+        self.respond('error', message)
+    
+    
+    def respond(self, status, payload):
+        '''
+        Send a response
+        
+        @param  status:str   `ok` or `error`
+        @param  payload:str  The result or description of the error
+        '''
+        if not self.replied:
+            self.replied = True
+            self.server.write('Response: %s %s %s' % (self.id, status, payload), self.client)
+    
+    
+    @staticmethod
+    def from_line(line, client, server):
+        '''
+        Parse a request
+        
+        @param   line:str        The request, without the `Request: ` prefix,
+                                 that is, the ID, the command and optionally
+                                 the argument, separated by single spaces
+        @param   client:DSocket  The client that sent the request
+        @param   server:Server   The server that received the request
+        @return  :Request?       The request, `None` if malformed, in which
+                                 case it has been failed if it has an ID
+        '''
+        parts = line.split(' ', 2)
+        if len(parts) < 2 or parts[1] == '':
+            if not parts[0] == '':
+                # Otherwise the client would wait for the response forever
+                Request(parts[0], None, None, client, server).fail('malformed request')
+            return None
+        return Request(parts[0], parts[1], parts[2] if len(parts) > 2 else None, client, server)
+
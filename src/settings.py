@@ -16,12 +16,21 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
+import ast
+import threading
+from fnmatch import fnmatchcase
 
 
 class Settings:
     '''
     Adjustment settings collections
     
+    The representation and the encoded messages are memoised. Values
+    must therefore be changed with `set_value`, or `invalidate` must
+    be called after changing settings in any other way. The memoised
+    values are only used under a lock, so the settings can be encoded
+    by several threads while others change them.
+    
     @variable  settings:list<Setting>  All settings
     @variable  script:str?             Script client's should source
     '''
@@ -34,6 +43,11 @@ class Settings:
         '''
         self.settings = []
         self.__settings = {}
+        self.__reprs = {}
+        # The representation under the key 'repr', and
+        # the encoded messages under their patterns
+        self.__memo = {}
+        self.__lock = threading.Lock()
         self.script = script
     
     
@@ -43,8 +57,98 @@ class Settings:
         
         @param  setting:Setting  The setting to add
         '''
-        self.settings.append(setting)
-        self.__settings[setting.name] = setting
+        with self.__lock:
+            self.settings.append(setting)
+            self.__settings[setting.name] = setting
+            self.__reprs.pop(setting.name, None)
+            self.__memo = {}
+    
+    
+    def set_value(self, key, value):
+        '''
+        Change the current value of a setting
+        
+        @param  key:str   The setting
+        @param  value:¿V  The new value
+        '''
+        with self.__lock:
+            self.__settings[key].current_value = value
+            self.__reprs.pop(key, None)
+            self.__memo = {}
+    
+    
+    def invalidate(self, key = None):
+        '''
+        Forget memoised representations after settings have been
+        changed without `set_value`
+        
+        @param  key:str?  The changed setting, `None` if unknown
+        '''
+        with self.__lock:
+            if key is None:
+                self.__reprs = {}
+            else:
+                self.__reprs.pop(key, None)
+            self.__memo = {}
+    
+    
+    def encode(self, patterns = None):
+        '''
+        Get the `Settings:` message for the settings, memoised
+        until the settings change
+        
+        @param   patterns:tuple<str>?  Only include settings whose names match any of these
+                                       names or glob patterns, `None` for all settings
+        @return  :bytes                The message, UTF-8 encoded with a terminating line break
+        '''
+        with self.__lock:
+            memo = self.__memo
+            if patterns not in memo:
+                settings = self.settings if patterns is None else self.__select(patterns)
+                memo[patterns] = ('Settings: %s\n' % self.__repr(settings)).encode('utf-8')
+            return memo[patterns]
+    
+    
+    def __repr(self, settings):
+        '''
+        Build the representation of some of the settings, reusing
+        the memoised representations of unchanged settings, must
+        be called with the lock held
+        
+        @param   settings:list<Setting>  The settings, must be in this collection
+        @return  :str                    Human- and machine-readable representation
+        '''
+        reprs, rc = self.__reprs, []
+        for setting in settings:
+            if setting.name not in reprs:
+                reprs[setting.name] = repr(setting)
+            rc.append(reprs[setting.name])
+        return '(%s, [%s])' % (repr(self.script), ', '.join(rc))
+    
+    
+    def select(self, patterns):
+        '''
+        Get the settings whose names match any of a set of patterns
+        
+        @param   patterns:itr<str>  Setting names or glob patterns
+        @return  :Settings          The matching settings, with the same script
+        '''
+        subset = Settings(self.script)
+        for setting in self.__select(patterns):
+            subset.add_setting(setting)
+        return subset
+    
+    
+    def __select(self, patterns):
+        '''
+        Get the settings whose names match any of a set of patterns
+        
+        @param   patterns:itr<str>  Setting names or glob patterns
+        @return  :list<Setting>     The matching settings
+        '''
+        patterns = list(patterns)
+        return [setting for setting in self.settings
+                if any(fnmatchcase(setting.name, pattern) for pattern in patterns)]
     
     
     def __contains__(self, key):
@@ -73,7 +177,11 @@ class Settings:
         
         @return  :str  Human- and machine-readable representation
         '''
-        return repr((self.script, self.settings))
+        with self.__lock:
+            memo = self.__memo
+            if 'repr' not in memo:
+                memo['repr'] = self.__repr(self.settings)
+            return memo['repr']
     
     
     @staticmethod
@@ -84,13 +192,163 @@ class Settings:
         @param   representation:str  The representation
         @return  :Settings           The setting
         '''
-        (script, settings_) = eval(representation)
+        (script, settings_) = ast.literal_eval(representation)
         settings = Settings(script)
         for setting in settings_:
             settings.add_setting(Setting.from_dict(setting))
         return settings
 
 
+class SettingsDecoder:
+    '''
+    Incremental decoder of the representation of a `Settings`
+    
+    The representation is fed in pieces of any size, as they arrive,
+    and each setting is decoded as soon as it is complete. Only the
+    text of the setting being received is kept, so the memory use
+    is bounded by the size of the largest setting, not by the size
+    of the whole representation. Unlike `Settings.from_repr`, only
+    literals are accepted.
+    
+    @variable  script:str?     The script client's should source, once it has been decoded
+    @variable  scripted:bool  Whether the script has been decoded
+    @variable  listed:bool    Whether the list of settings has ended
+    @variable  limit:int?     The maximum length of the representation of the script
+                              or a setting, `None` for no limit
+    '''
+    
+    def __init__(self, limit = None):
+        '''
+        Constructor
+        
+        @param  limit:int?  The maximum length of the representation of the script
+                            or a setting, `None` for no limit
+        '''
+        self.script = None
+        self.limit = limit
+        self.scripted = False
+        self.listed = False
+        self.pending = []
+        self.length = 0
+        self.depth = 0
+        self.quote = None
+        self.escaped = False
+        self.done = False
+    
+    
+    def feed(self, text):
+        '''
+        Decode the next piece of the representation
+        
+        @param   text:str        The piece of the representation
+        @return  :list<Setting>  The settings that were completed by the piece
+        @throws  ValueError      If the representation is malformed or a setting is too long
+        '''
+        rc, start = [], None
+        # The script is kept while the depth is 1 and a setting while the depth is
+        # at least 3, `start` is where the kept text begins in this piece, if kept
+        if (self.depth == 1 and not self.scripted) or self.depth >= 3:
+            start = 0
+        for (i, c) in enumerate(text):
+            if self.done:
+                if not c.isspace():
+                    raise ValueError('trailing data after settings')
+            elif self.quote is not None:
+                if self.escaped:
+                    self.escaped = False
+                elif c == '\\':
+                    self.escaped = True
+                elif c == self.quote:
+                    self.quote = None
+            elif c in '\'"':
+                if start is None:
+                    raise ValueError('unexpected string in settings')
+                self.quote = c
+            elif c in '([{':
+                self.depth += 1
+                if self.depth == 1:
+                    if not c == '(':
+                        raise ValueError('settings must be a tuple')
+                    start = i + 1
+                elif self.depth == 2:
+                    if not (c == '[' and self.scripted and not self.listed):
+                        raise ValueError('malformed settings')
+                elif self.depth == 3:
+                    if not c == '{':
+                        raise ValueError('setting must be a dictionary')
+                    start = i
+            elif c in ')]}':
+                self.depth -= 1
+                if self.depth < 0:
+                    raise ValueError('unbalanced brackets in settings')
+                elif self.depth == 2:
+                    self.keep(text[start : i + 1])
+                    try:
+                        rc.append(Setting.from_dict(self.take()))
+                    except (KeyError, TypeError) as err:
+                        raise ValueError('malformed setting: %s' % err)
+                    start = None
+                elif self.depth == 1:
+                    self.listed = True
+                elif self.depth == 0:
+                    if not self.listed:
+                        raise ValueError('settings are missing')
+                    self.done = True
+            elif c == ',' and self.depth == 1 and not self.scripted:
+                self.keep(text[start : i])
+                self.script = self.take()
+                if not (self.script is None or isinstance(self.script, str)):
+                    raise ValueError('script must be a string or None')
+                self.scripted = True
+                start = None
+            elif start is None and not (c.isspace() or (c == ',' and self.depth > 0)):
+                # Only the script and the settings are kept, anything
+                # between them but separators is not part of a tuple
+                raise ValueError('unexpected %s in settings' % repr(c))
+        if start is not None:
+            self.keep(text[start:])
+        return rc
+    
+    
+    def keep(self, text):
+        '''
+        Add text to the representation of the script or setting being decoded
+        
+        @param   text:str    The text
+        @throws  ValueError  If the representation becomes too long
+        '''
+        self.length += len(text)
+        if self.limit is not None and self.length > self.limit:
+            raise ValueError('setting is too long')
+        self.pending.append(text)
+    
+    
+    def take(self):
+        '''
+        Decode and forget the kept representation of the script or setting
+        
+        @return  :¿V?  The decoded value
+        '''
+        text = ''.join(self.pending)
+        (self.pending, self.length) = ([], 0)
+        try:
+            return ast.literal_eval(text.strip())
+        except (SyntaxError, ValueError) as err:
+            raise ValueError('malformed setting: %s' % err)
+    
+    
+    def close(self):
+        '''
+        Check that the representation has been fed completely
+        
+        @return  :str?       The script client's should source
+        @throws  ValueError  If the representation is incomplete
+        '''
+        if not self.done:
+            raise ValueError('settings are incomplete')
+        return self.script
+
+
 class Setting:
     '''
     Adjustment setting instance
@@ -159,15 +417,15 @@ class Setting:
         
         @return  :str  Human- and machine-readable representation
         '''
-        as_dict = { 'name'            : name
-                  , 'title'           : title
-                  , 'default_value'   : default_value
-                  , 'current_value'   : current_value
-                  , 'value_type'      : value_type
-                  , 'minimum'         : minimum
-                  , 'maximum'         : maximum
-                  , 'epsilon'         : epsilon
-                  , 'possible_values' : possible_values
+        as_dict = { 'name'            : self.name
+                  , 'title'           : self.title
+                  , 'default_value'   : self.default_value
+                  , 'current_value'   : self.current_value
+                  , 'value_type'      : self.value_type
+                  , 'minimum'         : self.minimum
+                  , 'maximum'         : self.maximum
+                  , 'epsilon'         : self.epsilon
+                  , 'possible_values' : self.possible_values
                   }
         return repr(as_dict)
     
@@ -180,10 +438,8 @@ class Setting:
         @param   dictionary:dict<str, str|int|float|¿V??>  The dictionary
         @return  :Setting                                  The setting
         '''
-        values = 'name, title, default_value, value_type, minimum, maximum, epsilon, possible_values'
-        setting = Setting(*[dictionary[value] for value in values.split(', ')])
-        setting.current_value = dictionary['current_value']
-        return setting
+        values = 'name, title, default_value, current_value, value_type, minimum, maximum, epsilon, possible_values'
+        return Setting(*[dictionary[value] for value in values.split(', ')])
     
     
     @staticmethod
@@ -194,5 +450,152 @@ class Setting:
         @param   representation:str  The representation
         @return  :Setting            The setting
         '''
-        return Setting.from_dict(eval(representation))
+        return Setting.from_dict(ast.literal_eval(representation))
+
 
+
+class Transition:
+    '''
+    Keyframe describing how a numeric setting changes over time
+    
+    Rather than sending every intermediate value, the server describes
+    the whole trajectory once, and the client interpolates it at its own
+    frame rate. The times are of the monotonic clock, which is shared by
+    the server and the client as they run on the same machine.
+    
+    @variable  name:str               The name/code of the setting
+    @variable  start_value:int|float  The value at the start of the transition
+    @variable  end_value:int|float    The value at the end of the transition
+    @variable  start_time:int         The monotonic time, in nanoseconds, the transition starts
+    @variable  duration:int           The length of the transition, in nanoseconds
+    @variable  easing:str             The easing function, a key in `EASINGS`
+    '''
+    
+    
+    EASINGS = { 'linear'      : lambda t : t
+              , 'ease-in'     : lambda t : t * t
+              , 'ease-out'    : lambda t : t * (2 - t)
+              , 'ease-in-out' : lambda t : t * t * (3 - 2 * t)
+              }
+    '''
+    :dict<str, (float)→float>  Easing functions, by name, mapping the elapsed
+                               fraction of the duration to the fraction of the
+                               change from the start value to the end value
+    '''
+    
+    
+    def __init__(self, name, start_value, end_value, start_time, duration, easing = 'linear'):
+        '''
+        Constructor
+        
+        @param  name:str               The name/code of the setting
+        @param  start_value:int|float  The value at the start of the transition
+        @param  end_value:int|float    The value at the end of the transition
+        @param  start_time:int         The monotonic time, in nanoseconds, the transition starts
+        @param  duration:int           The length of the transition, in nanoseconds
+        @param  easing:str             The easing function, a key in `EASINGS`
+        '''
+        if easing not in Transition.EASINGS:
+            raise ValueError('unknown easing function: %s' % easing)
+        self.name        = name
+        self.start_value = start_value
+        self.end_value   = end_value
+        self.start_time  = start_time
+        self.duration    = duration
+        self.easing      = easing
+    
+    
+    def value_at(self, time):
+        '''
+        Get the value of the setting at a point in time
+        
+        @param   time:int    The monotonic time, in nanoseconds
+        @return  :int|float  The value, integral if both the start and the end values are
+        '''
+        if time >= self.start_time + self.duration:
+            return self.end_value
+        if time <= self.start_time:
+            return self.start_value
+        fraction = Transition.EASINGS[self.easing]((time - self.start_time) / self.duration)
+        value = self.start_value + (self.end_value - self.start_value) * fraction
+        if isinstance(self.start_value, int) and isinstance(self.end_value, int):
+            value = int(round(value))
+        return value
+    
+    
+    def finished(self, time):
+        '''
+        Check whether the transition is over
+        
+        @param   time:int  The monotonic time, in nanoseconds
+        @return  :bool     Whether the setting has reached its end value
+        '''
+        return time >= self.start_time + self.duration
+    
+    
+    def passes(self, value, time):
+        '''
+        Check whether a value reported at a point in time is on the trajectory,
+        that is, whether it is the start or end value, or is within one percent
+        of the change from the interpolated value
+        
+        @param   value:¿V?  The value
+        @param   time:int   The monotonic time, in nanoseconds
+        @return  :bool      Whether the value is on the trajectory
+        '''
+        if value == self.start_value or value == self.end_value:
+            return True
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        return abs(value - self.value_at(time)) <= abs(self.end_value - self.start_value) / 100
+    
+    
+    def __eq__(self, other):
+        '''
+        Check whether two keyframes describe the same trajectory
+        
+        @param   other:Transition  The other keyframe
+        @return  :bool             Whether the keyframes are identical
+        '''
+        if not isinstance(other, Transition):
+            return NotImplemented
+        return repr(self) == repr(other)
+    
+    
+    def __repr__(self):
+        '''
+        Convert to human- and machine-readable representation
+        
+        @return  :str  Human- and machine-readable representation
+        '''
+        as_dict = { 'name'        : self.name
+                  , 'start_value' : self.start_value
+                  , 'end_value'   : self.end_value
+                  , 'start_time'  : self.start_time
+                  , 'duration'    : self.duration
+                  , 'easing'      : self.easing
+                  }
+        return repr(as_dict)
+    
+    
+    @staticmethod
+    def from_dict(dictionary):
+        '''
+        Convert from a dictionary
+        
+        @param   dictionary:dict<str, str|int|float>  The dictionary
+        @return  :Transition                          The keyframe
+        '''
+        values = 'name, start_value, end_value, start_time, duration, easing'
+        return Transition(*[dictionary[value] for value in values.split(', ')])
+    
+    
+    @staticmethod
+    def from_repr(representation):
+        '''
+        Convert from human- and machine-readable representation
+        
+        @param   representation:str  The representation
+        @return  :Transition         The keyframe
+        '''
+        return Transition.from_dict(ast.literal_eval(representation))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import sys
+import ast
+import math
+import time
+import argparse
+
+from server import Server
+from settings import Settings, Setting, Transition
+
+
+def synthetic_settings(count):
+    '''
+    Create a collection of synthetic settings
+    
+    @param   count:int  The number of settings
+    @return  :Settings  The settings
+    '''
+    settings = Settings()
+    for i in range(count):
+        name = 'synthetic%i' % i
+        title = 'Synthetic setting %i' % i
+        settings.add_setting(Setting(name, title, 0.5, 0.5, Setting.TYPE_FLOAT, 0.0, 1.0, 0.001))
+    return settings
+
+
+def advance(settings, tick, changes):
+    '''
+    Change the values of the synthetic settings
+    
+    @param  settings:Settings  The settings
+    @param  tick:int           The number of the broadcast
+    @param  changes:int        The number of settings to change, the
+                               changed settings rotate between broadcasts
+    '''
+    count = len(settings.settings)
+    for i in range(min(changes, count)):
+        index = (tick * changes + i) % count
+        setting = settings.settings[index]
+        settings.set_value(setting.name, 0.5 + 0.5 * math.sin(tick / 60 + index))
+
+
+def keyframes(settings, step, start, duration):
+    '''
+    Get the keyframes of a transition of the synthetic settings
+    
+    @param   settings:Settings   The settings
+    @param   step:int            The number of the transition
+    @param   start:int           The monotonic time, in nanoseconds, the first transition started
+    @param   duration:int        The length of each transition, in nanoseconds
+    @return  :list<Transition>  The keyframe of each setting
+    '''
+    rc = []
+    for (index, setting) in enumerate(settings.settings):
+        (begin, end) = [0.5 + 0.5 * math.sin(s + index) for s in (step, step + 1)]
+        rc.append(Transition(setting.name, begin, end, start + step * duration, duration, 'ease-in-out'))
+    return rc
+
+
+def main(args = None):
+    '''
+    Run the stand-in server
+    
+    Every broadcast is a `Settings:` snapshot, limited to each client's
+    subscription, followed by a `Sequence:` line with the number of the
+    broadcast, so that receivers can detect lost messages. Tracing is
+    always enabled so that receivers can measure the delivery latency.
+    
+    With `--transition`, the settings instead change continuously, and
+    only one `Transition:` keyframe per setting and transition is sent,
+    however often the keyframes are broadcasted.
+    
+    @param  args:list<str>?  Command line arguments, `None` for `sys.argv[1:]`
+    '''
+    parser = argparse.ArgumentParser(prog = 'standin', description = 'Stand-in blueshift server')
+    parser.add_argument('--socket', default = None, help = 'socket pathname, the current display\'s by default')
+    parser.add_argument('--rate', type = float, default = 60.0, help = 'broadcasts per second')
+    parser.add_argument('--settings', type = int, default = 10, help = 'number of settings')
+    parser.add_argument('--changes', type = int, default = None, help = 'settings changed per broadcast, all by default')
+    parser.add_argument('--duration', type = float, default = None, help = 'seconds to run, forever by default')
+    parser.add_argument('--transition', type = float, default = None, help = 'seconds per transition, off by default')
+    args = parser.parse_args(args)
+    
+    settings = synthetic_settings(args.settings)
+    changes = args.settings if args.changes is None else args.changes
+    
+    if args.socket is not None:
+        try:
+            os.unlink(args.socket)
+        except FileNotFoundError:
+            pass
+    
+    with Server(trace = True, sockfile = args.socket) as server:
+        def greet(client):
+            server.write('PID: %i' % os.getpid(), client)
+        server.listen(greet)
+        def set_(request):
+            (name, value) = ((request.argument or '').split(' ', 1) + [''])[:2]
+            try:
+                value = ast.literal_eval(value)
+            except (SyntaxError, ValueError):
+                raise Exception('malformed value: %s' % value)
+            # The value has been checked by the server
+            settings.set_value(name, value)
+            server.broadcast_settings(settings)
+        server.handlers['set'] = set_
+        server.serve()
+        
+        tick, interval = 0, 1 / args.rate
+        start = time.monotonic()
+        deadline = start
+        while args.duration is None or deadline - start < args.duration:
+            if args.transition is None:
+                advance(settings, tick, changes)
+                server.broadcast_settings(settings)
+            else:
+                duration = int(args.transition * 1e9)
+                step = int((time.monotonic() - start) / args.transition)
+                changed = False
+                for transition in keyframes(settings, step, int(start * 1e9), duration):
+                    if server.broadcast_transition(transition):
+                        settings.set_value(transition.name, transition.end_value)
+                        changed = True
+                if changed:
+                    server.broadcast_settings(settings)
+            server.broadcast('Sequence: %i' % tick)
+            tick += 1
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        sys.stderr.buffer.write(('%i broadcasts sent\n' % tick).encode('utf-8'))
+        sys.stderr.buffer.flush()
+
+
+if __name__ == '__main__':
+    main()
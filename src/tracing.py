@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import json
+from array import array
+
+
+class Tracer:
+    '''
+    Ring buffer of update latency traces
+    
+    Each record holds one monotonic timestamp, in nanoseconds, per stage
+    of an update's trip from the server to the screen. A stage that has
+    not been reached is zero. When the buffer is full the oldest records
+    are overwritten.
+    
+    @variable  capacity:int    The number of records the buffer can hold
+    @variable  records:array   The records, `STAGES` values per record
+    @variable  count:int       The number of records that have been started
+    @variable  painted:int     The number of records that have been considered by `paint`
+    '''
+    
+    SENT = 0
+    '''
+    Stage: the server wrote the message
+    '''
+    
+    RECEIVED = 1
+    '''
+    Stage: the client read the message
+    '''
+    
+    PARSED = 2
+    '''
+    Stage: the client parsed the payload
+    '''
+    
+    SOURCED = 3
+    '''
+    Stage: the client sourced the requested script, if any
+    '''
+    
+    APPLIED = 4
+    '''
+    Stage: the client applied the settings and woke the renderer
+    '''
+    
+    PAINTED = 5
+    '''
+    Stage: the renderer flushed a frame containing the update
+    '''
+    
+    STAGES = 6
+    '''
+    The number of stages
+    '''
+    
+    PHASES = (('transport', SENT,     RECEIVED),
+              ('parse',     RECEIVED, PARSED),
+              ('script',    PARSED,   SOURCED),
+              ('apply',     SOURCED,  APPLIED),
+              ('paint',     APPLIED,  PAINTED))
+    '''
+    The name, start stage and end stage of each phase in a record
+    '''
+    
+    
+    def __init__(self, capacity = 4096):
+        '''
+        Constructor
+        
+        @param  capacity:int  The number of records the buffer can hold
+        '''
+        self.capacity = capacity
+        self.records = array('q', bytes(8 * Tracer.STAGES * capacity))
+        self.count = 0
+        self.painted = 0
+    
+    
+    def begin(self, sent, received):
+        '''
+        Start a new record
+        
+        @param   sent:int      The time the server wrote the message
+        @param   received:int  The time the client read the message
+        @return  :int          The offset of the record, for `stamp`
+        '''
+        offset = (self.count % self.capacity) * Tracer.STAGES
+        records = self.records
+        for stage in range(Tracer.STAGES):
+            records[offset + stage] = 0
+        records[offset + Tracer.SENT] = sent
+        records[offset + Tracer.RECEIVED] = received
+        self.count += 1
+        return offset
+    
+    
+    def stamp(self, offset, stage, time):
+        '''
+        Record when a record reached a stage
+        
+        @param  offset:int  The offset of the record, as returned by `begin`
+        @param  stage:int   The stage
+        @param  time:int    The monotonic time, in nanoseconds
+        '''
+        self.records[offset + stage] = time
+    
+    
+    def paint(self, time):
+        '''
+        Record that a frame has been painted, completing all
+        records that have been applied but not yet painted
+        
+        @param  time:int  The monotonic time, in nanoseconds
+        '''
+        count, records = self.count, self.records
+        for index in range(max(self.painted, count - self.capacity), count):
+            offset = (index % self.capacity) * Tracer.STAGES
+            if records[offset + Tracer.APPLIED] and not records[offset + Tracer.PAINTED]:
+                records[offset + Tracer.PAINTED] = time
+        self.painted = count
+    
+    
+    def events(self):
+        '''
+        Convert the buffered records to Chrome trace events
+        
+        @return  :list<dict<str, str|int|float>>  The events
+        '''
+        events, pid = [], os.getpid()
+        count, records = self.count, self.records
+        for index in range(max(0, count - self.capacity), count):
+            offset = (index % self.capacity) * Tracer.STAGES
+            for (name, start, end) in Tracer.PHASES:
+                start, end = records[offset + start], records[offset + end]
+                if start and end:
+                    events.append({ 'name' : name
+                                  , 'cat'  : 'update'
+                                  , 'ph'   : 'X'
+                                  , 'ts'   : start / 1000
+                                  , 'dur'  : (end - start) / 1000
+                                  , 'pid'  : pid
+                                  , 'tid'  : index
+                                  })
+        return events
+    
+    
+    def dump(self, pathname):
+        '''
+        Write the buffered records as Chrome trace-event JSON
+        
+        @param  pathname:str  The file to write
+        '''
+        with open(pathname, 'wb') as file:
+            file.write(json.dumps({ 'traceEvents' : self.events() }).encode('utf-8'))
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+from array import array
+from bisect import bisect_left
+
+from settings import Setting
+
+
+def hashable(value):
+    '''
+    Get a hashable equivalent of a value, lists are replaced by tuples
+    
+    @param   value:¿V?  The value
+    @return  :¿V?       The value, with lists replaced by tuples
+    '''
+    if isinstance(value, list):
+        return tuple(hashable(element) for element in value)
+    return value
+
+
+class SettingIndex:
+    '''
+    The constraints of a setting, indexed for checking values quickly
+    
+    For numeric settings, the possible values are kept in a hash set
+    and a sorted array, so membership is checked in constant time and
+    the nearest possible value is found by bisection. For string and
+    string list settings, the minimum and maximum are lengths, and
+    for string lists, the possible values are either whole lists or
+    those of the elements. Possible values that cannot be hashed, even
+    with lists as tuples, are kept in a list and checked one by one.
+    
+    @variable  setting:Setting          The setting the index was built from
+    @variable  allowed:frozenset|list?  The possible values, `None` if any value is allowed
+    @variable  ordered:array?      The possible values within the minimum and maximum,
+                                   sorted, if the setting is numeric
+    '''
+    
+    def __init__(self, setting):
+        '''
+        Constructor
+        
+        @param  setting:Setting  The setting
+        '''
+        self.setting = setting
+        self.allowed = None
+        self.ordered = None
+        if setting.possible_values is not None:
+            try:
+                self.allowed = frozenset(hashable(value) for value in setting.possible_values)
+            except TypeError:
+                self.allowed = list(setting.possible_values)
+            if setting.value_type in (Setting.TYPE_INTEGER, Setting.TYPE_FLOAT):
+                # Only values that `check` allows can be snapped to
+                ordered = sorted(value for value in self.allowed if not isinstance(value, bool)
+                                 and isinstance(value, (int, float)))
+                if setting.minimum is not None:
+                    ordered = [v for v in ordered if v >= setting.minimum]
+                if setting.maximum is not None:
+                    ordered = [v for v in ordered if v <= setting.maximum]
+                self.ordered = array('d', ordered)
+    
+    
+    def matches(self, setting):
+        '''
+        Check whether the index is still valid for a setting
+        
+        @param   setting:Setting  The setting, possibly a newer copy of the one indexed
+        @return  :bool            Whether the setting has the same constraints
+        '''
+        old = self.setting
+        if old is setting:
+            return True
+        return (old.value_type, old.minimum, old.maximum, old.epsilon, old.possible_values) == \
+               (setting.value_type, setting.minimum, setting.maximum, setting.epsilon, setting.possible_values)
+    
+    
+    def check(self, value):
+        '''
+        Check whether a value is allowed
+        
+        @param   value:¿V?  The value
+        @return  :str?      Why the value is not allowed, `None` if it is allowed
+        '''
+        (setting, value_type) = (self.setting, self.setting.value_type)
+        if value_type == Setting.TYPE_STRING:
+            if not isinstance(value, str):
+                return 'must be a string'
+            (measure, elements) = (len(value), (value,))
+        elif value_type == Setting.TYPE_LIST:
+            if not (isinstance(value, list) and all(isinstance(e, str) for e in value)):
+                return 'must be a list of strings'
+            (measure, elements) = (len(value), value)
+        elif value_type in (Setting.TYPE_INTEGER, Setting.TYPE_FLOAT):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return 'must be a number'
+            if value_type == Setting.TYPE_INTEGER and not isinstance(value, int):
+                return 'must be an integer'
+            (measure, elements) = (value, (value,))
+        else:
+            return None
+        if setting.minimum is not None and measure < setting.minimum:
+            return 'must be at least %s' % setting.minimum
+        if setting.maximum is not None and measure > setting.maximum:
+            return 'must be at most %s' % setting.maximum
+        if self.allowed is not None and not self.allows(value):
+            for element in elements:
+                if not self.allows(element):
+                    return '%s is not a possible value' % repr(element)
+        return None
+    
+    
+    def allows(self, value):
+        '''
+        Check whether a value is one of the possible values
+        
+        @param   value:¿V?  The value
+        @return  :bool      Whether the value is one of the possible values
+        '''
+        if isinstance(self.allowed, frozenset):
+            return hashable(value) in self.allowed
+        return value in self.allowed
+    
+    
+    def snap(self, value):
+        '''
+        Get the allowed value nearest to a numeric value, other
+        values are returned as is if they are allowed
+        
+        @param   value:¿V?   The value
+        @return  :¿V?        The nearest allowed value
+        @throws  ValueError  If the value is not allowed and cannot be snapped
+        '''
+        setting = self.setting
+        if setting.value_type not in (Setting.TYPE_INTEGER, Setting.TYPE_FLOAT) or \
+           isinstance(value, bool) or not isinstance(value, (int, float)):
+            error = self.check(value)
+            if error is not None:
+                raise ValueError(error)
+            return value
+        if self.ordered is not None:
+            if len(self.ordered) == 0:
+                raise ValueError('there are no possible values')
+            i = bisect_left(self.ordered, value)
+            if i == len(self.ordered) or (i > 0 and value - self.ordered[i - 1] <= self.ordered[i] - value):
+                i -= 1
+            value = self.ordered[i]
+        else:
+            if setting.epsilon:
+                base = 0 if setting.minimum is None else setting.minimum
+                value = base + round((value - base) / setting.epsilon) * setting.epsilon
+            if setting.minimum is not None:
+                value = max(setting.minimum, value)
+            if setting.maximum is not None:
+                value = min(setting.maximum, value)
+        if setting.value_type == Setting.TYPE_INTEGER:
+            value = int(round(value))
+        return value
+
+
+class Validator:
+    '''
+    Validates values of many settings at once
+    
+    The index of each setting is built once, and only rebuilt
+    if a newer copy of the setting has different constraints.
+    
+    @variable  indexes:dict<str, SettingIndex>  The index of each setting, by name
+    '''
+    
+    def __init__(self, settings = None):
+        '''
+        Constructor
+        
+        @param  settings:Settings?  The settings to index
+        '''
+        self.indexes = {}
+        if settings is not None:
+            self.index(settings)
+    
+    
+    def index(self, settings):
+        '''
+        Index settings, replacing the indexes of any earlier settings,
+        the indexes of settings whose constraints have not changed are reused
+        
+        @param  settings:Settings  The settings
+        '''
+        (old, indexes) = (self.indexes, {})
+        for setting in settings.settings:
+            index = old.get(setting.name, None)
+            if index is None or not index.matches(setting):
+                index = SettingIndex(setting)
+            indexes[setting.name] = index
+        self.indexes = indexes
+    
+    
+    def validate(self, values):
+        '''
+        Check values of settings
+        
+        @param   values:dict<str, ¿V?>  The values, by setting name
+        @return  :dict<str, str>        Why each value that is not allowed is not
+                                        allowed, by setting name, empty if all are allowed
+        '''
+        (rc, indexes) = ({}, self.indexes)
+        for (name, value) in values.items():
+            index = indexes.get(name, None)
+            error = 'unknown setting' if index is None else index.check(value)
+            if error is not None:
+                rc[name] = error
+        return rc
+    
+    
+    def snap(self, values):
+        '''
+        Replace values of settings with the nearest allowed values
+        
+        @param   values:dict<str, ¿V?>                The values, by setting name
+        @return  :(dict<str, ¿V?>, dict<str, str>)  The allowed values, by setting name, and
+                                                    why each value that could not be snapped
+                                                    is not allowed, by setting name
+        '''
+        (rc, errors, indexes) = ({}, {}, self.indexes)
+        for (name, value) in values.items():
+            index = indexes.get(name, None)
+            if index is None:
+                errors[name] = 'unknown setting'
+                continue
+            try:
+                rc[name] = index.snap(value)
+            except ValueError as err:
+                errors[name] = str(err)
+        return (rc, errors)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+'''
+blueshift-curse – Blueshift extension with IPC and an ncurses front-end
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+from functools import lru_cache
+
+from settings import Setting
+
+
+PARTIAL_BLOCKS = ' ▏▎▍▌▋▊▉'
+'''
+:str  Blocks filled by zero to seven eighths, from the left
+'''
+
+STYLES = { 'normal'   : '\033[0;34m'
+         , 'selected' : '\033[0;1;36m'
+         }
+'''
+:dict<str, str>  The escape sequence that begins each style of slider
+'''
+
+CACHE_SIZE = 4096
+'''
+:int  The maximum number of rendered sliders to keep
+'''
+
+
+def quantise(setting):
+    '''
+    Get the position of a numeric setting's value between its
+    minimum and its maximum, rounded to its epsilon
+    
+    @param   setting:Setting  The setting
+    @return  :float?          The position, between 0 and 1 inclusively,
+                              `None` if the setting does not have a position
+    '''
+    if setting.value_type not in (Setting.TYPE_INTEGER, Setting.TYPE_FLOAT):
+        return None
+    (value, low, high) = (setting.current_value, setting.minimum, setting.maximum)
+    if value is None or low is None or high is None or not high > low:
+        return None
+    if setting.epsilon:
+        value = low + round((value - low) / setting.epsilon) * setting.epsilon
+    return min(1, max(0, (value - low) / (high - low)))
+
+
+def slider(setting, width, style = 'normal'):
+    '''
+    Render a numeric setting as a horizontal bar
+    
+    @param   setting:Setting  The setting
+    @param   width:int        The number of columns
+    @param   style:str        The style, a key in `STYLES`
+    @return  :bytes           The bar, UTF-8 encoded, blank if the setting does not have a position
+    '''
+    if width <= 0:
+        return b''
+    position = quantise(setting)
+    if position is None:
+        return b' ' * width
+    return render_slider(width, int(position * width * 8 + 0.5), style)
+
+
+@lru_cache(maxsize = CACHE_SIZE)
+def render_slider(width, eighths, style):
+    '''
+    Render a horizontal bar, memoised
+    
+    @param   width:int    The number of columns
+    @param   eighths:int  The number of eighths of columns to fill
+    @param   style:str    The style, a key in `STYLES`
+    @return  :bytes       The bar, UTF-8 encoded
+    '''
+    (full, partial) = divmod(eighths, 8)
+    bar = '█' * full
+    if full < width:
+        bar += PARTIAL_BLOCKS[partial] + ' ' * (width - full - 1)
+    return (STYLES[style] + bar + '\033[0m').encode('utf-8')
+
+
+def clear():
+    '''
+    Forget all rendered sliders, should be called when the terminal is resized
+    '''
+    render_slider.cache_clear()